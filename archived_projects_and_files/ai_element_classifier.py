@@ -4,9 +4,12 @@ import torch
 from PIL import Image
 import clip
 from transformers import pipeline
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import os
+import hashlib
 import logging
+from metrics import count_cache, count_fallback
+from tracing import span
 
 class AIElementClassifier:
     """
@@ -14,10 +17,14 @@ class AIElementClassifier:
     Based on Meta's children's drawing animation research with enhanced functionality
     """
     
-    def __init__(self):
+    def __init__(self, text_features_cache_dir: Optional[str] = None):
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.logger = self._setup_logging()
         
+        # Normalized CLIP text features per drawing context, optionally persisted to disk
+        self.text_features_cache_dir = text_features_cache_dir
+        self._text_features = {}
+        
         # Enhanced object categories with animation behaviors (inspired by Meta's research)
         self.object_categories = {
             'sun': {'movement': 'arc_motion', 'speed': 'slow', 'pattern': 'sunrise_sunset', 'layer': 'background'},
@@ -66,7 +73,8 @@ class AIElementClassifier:
         """Initialize AI models for object classification"""
         try:
             # CLIP for semantic understanding
-            self.clip_model, self.clip_preprocess = clip.load("ViT-B/32", device=self.device)
+            self.clip_model_name = "ViT-B/32"
+            self.clip_model, self.clip_preprocess = clip.load(self.clip_model_name, device=self.device)
             self.logger.info("✅ CLIP model loaded for object classification")
             
             # Object labels for classification
@@ -102,56 +110,105 @@ class AIElementClassifier:
             # Preprocess for CLIP
             image_input = self.clip_preprocess(pil_image).unsqueeze(0).to(self.device)
             
-            # Create context-aware text prompts
-            prompt_template = self.context_prompts.get(drawing_context, "a drawing of a {object}")
-            text_prompts = [prompt_template.format(object=label) for label in self.object_labels]
-            text_inputs = clip.tokenize(text_prompts).to(self.device)
+            # Context-aware text features are encoded once per drawing context
+            text_features = self._get_text_features(drawing_context)
             
             # Get predictions
             with torch.no_grad():
                 image_features = self.clip_model.encode_image(image_input)
-                text_features = self.clip_model.encode_text(text_inputs)
+                image_features = image_features / image_features.norm(dim=-1, keepdim=True)
                 
                 # Calculate similarities
                 similarities = (100.0 * image_features @ text_features.T).softmax(dim=-1)
             
-            # Get top 3 matches for better decision making
-            top3_indices = similarities.argsort(descending=True)[0][:3]
-            top3_scores = [similarities[0][idx].item() for idx in top3_indices]
-            top3_labels = [self.object_labels[idx] for idx in top3_indices]
-            
-            # Add shape-based hints for better classification
-            shape_hints = self._analyze_shape_hints(element_info)
-            
-            # Refine classification with shape hints and context
-            predicted_label = self._refine_with_context(top3_labels, top3_scores, shape_hints, drawing_context)
-            confidence = top3_scores[0] if predicted_label == top3_labels[0] else top3_scores[top3_labels.index(predicted_label)]
-            
-            # Get animation properties
-            animation_props = self.object_categories.get(predicted_label, {
-                'movement': 'float', 'speed': 'medium', 'pattern': 'gentle_motion', 'layer': 'foreground'
-            })
-            
-            # Calculate psychological significance
-            psychological_significance = self._assess_psychological_significance(predicted_label, element_info)
-            
-            return {
-                'label': predicted_label,
-                'confidence': confidence,
-                'animation_type': animation_props['movement'],
-                'animation_speed': animation_props['speed'],
-                'animation_pattern': animation_props['pattern'],
-                'layer': animation_props['layer'],
-                'shape_hints': shape_hints,
-                'top3_predictions': list(zip(top3_labels, top3_scores)),
-                'psychological_significance': psychological_significance,
-                'element_properties': self._extract_element_properties(element_info)
-            }
+            return self._classify_from_similarities(similarities[0], element_info, drawing_context)
             
         except Exception as e:
             self.logger.error(f"⚠️ Classification failed: {e}")
             return self._fallback_classification(element_info)
     
+    def _classify_from_similarities(self, similarities: torch.Tensor, element_info: Dict,
+                                    drawing_context: str) -> Dict:
+        """Turn one row of label similarities into a classification result"""
+        # Get top 3 matches for better decision making
+        top3_indices = similarities.argsort(descending=True)[:3]
+        top3_scores = [similarities[idx].item() for idx in top3_indices]
+        top3_labels = [self.object_labels[idx] for idx in top3_indices]
+        
+        # Add shape-based hints for better classification
+        shape_hints = self._analyze_shape_hints(element_info)
+        
+        # Refine classification with shape hints and context
+        predicted_label = self._refine_with_context(top3_labels, top3_scores, shape_hints, drawing_context)
+        confidence = top3_scores[0] if predicted_label == top3_labels[0] else top3_scores[top3_labels.index(predicted_label)]
+        
+        # Get animation properties
+        animation_props = self.object_categories.get(predicted_label, {
+            'movement': 'float', 'speed': 'medium', 'pattern': 'gentle_motion', 'layer': 'foreground'
+        })
+        
+        # Calculate psychological significance
+        psychological_significance = self._assess_psychological_significance(predicted_label, element_info)
+        
+        return {
+            'label': predicted_label,
+            'confidence': confidence,
+            'animation_type': animation_props['movement'],
+            'animation_speed': animation_props['speed'],
+            'animation_pattern': animation_props['pattern'],
+            'layer': animation_props['layer'],
+            'shape_hints': shape_hints,
+            'top3_predictions': list(zip(top3_labels, top3_scores)),
+            'psychological_significance': psychological_significance,
+            'element_properties': self._extract_element_properties(element_info)
+        }
+    
+    def _get_text_features(self, drawing_context: str) -> torch.Tensor:
+        """Return normalized text features for a drawing context, encoding them only once"""
+        if drawing_context in self._text_features:
+            count_cache('clip_text_features', True)
+            return self._text_features[drawing_context]
+        
+        prompt_template = self.context_prompts.get(drawing_context, "a drawing of a {object}")
+        text_prompts = [prompt_template.format(object=label) for label in self.object_labels]
+        
+        cache_path = self._text_features_cache_path(text_prompts)
+        text_features = None
+        if cache_path and os.path.exists(cache_path):
+            try:
+                text_features = torch.load(cache_path, map_location=self.device)
+                self.logger.info(f"✅ Loaded cached text features for '{drawing_context}'")
+            except Exception as e:
+                self.logger.warning(f"⚠️ Could not load cached text features: {e}")
+                text_features = None
+        
+        count_cache('clip_text_features', text_features is not None)
+        if text_features is None:
+            text_inputs = clip.tokenize(text_prompts).to(self.device)
+            with torch.no_grad():
+                text_features = self.clip_model.encode_text(text_inputs)
+                text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+            
+            if cache_path:
+                try:
+                    os.makedirs(self.text_features_cache_dir, exist_ok=True)
+                    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                    torch.save(text_features.cpu(), tmp_path)
+                    os.replace(tmp_path, cache_path)
+                except Exception as e:
+                    self.logger.warning(f"⚠️ Could not save text features cache: {e}")
+        
+        self._text_features[drawing_context] = text_features
+        return text_features
+    
+    def _text_features_cache_path(self, text_prompts: List[str]) -> Optional[str]:
+        """Cache file for a prompt set, keyed by model name and the exact prompts"""
+        if not self.text_features_cache_dir:
+            return None
+        
+        key = hashlib.sha256("\n".join([self.clip_model_name] + text_prompts).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.text_features_cache_dir, f"clip_text_{key}.pt")
+    
     def _analyze_shape_hints(self, element_info: Dict) -> Dict:
         """Analyze shape characteristics to help with classification"""
         bbox = element_info['bbox']
@@ -409,21 +466,58 @@ class AIElementClassifier:
             return 'bottom_right'
     
     def classify_multiple_elements(self, elements: List[Dict], 
-                                 drawing_context: str = "children_drawing") -> List[Dict]:
-        """Classify multiple elements in a batch"""
-        
-        results = []
-        for element_data in elements:
-            element_image = element_data['image']
-            element_info = element_data
-            classification = self.classify_element(element_image, element_info, drawing_context)
-            results.append(classification)
+                                 drawing_context: str = "children_drawing",
+                                 batch_size: int = 32) -> List[Dict]:
+        """Classify multiple elements (dicts or ElementRecords) with batched CLIP image encoding"""
+        
+        if self.clip_model is None or not elements:
+            if elements:
+                count_fallback('clip_unavailable')
+            results = [self._fallback_classification(element_data) for element_data in elements]
+        else:
+            try:
+                results = self._classify_batch(elements, drawing_context, batch_size)
+            except Exception as e:
+                self.logger.error(f"⚠️ Batched classification failed, classifying one by one: {e}")
+                count_fallback('clip_batch_failed')
+                results = [self.classify_element(element_data['image'], element_data, drawing_context)
+                           for element_data in elements]
         
         # Add inter-element relationships
         results = self._analyze_element_relationships(results)
         
         return results
     
+    def _classify_batch(self, elements: List[Dict], drawing_context: str, batch_size: int) -> List[Dict]:
+        """Encode all element crops in chunked forward passes and classify each row"""
+        text_features = self._get_text_features(drawing_context)
+        
+        # Preprocess every crop up front so each forward pass sees a full batch
+        with span('clip_preprocess', elements=len(elements)):
+            image_inputs = torch.stack([
+                self.clip_preprocess(Image.fromarray(element_data['image'])) for element_data in elements
+            ])
+        
+        similarity_rows = []
+        with torch.no_grad():
+            for start in range(0, len(elements), batch_size):
+                with span('clip_forward', first=start, batch_size=min(batch_size, len(elements) - start)):
+                    batch = image_inputs[start:start + batch_size].to(self.device)
+                    image_features = self.clip_model.encode_image(batch)
+                    image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+                    similarity_rows.append((100.0 * image_features @ text_features.T).softmax(dim=-1).cpu())
+        
+        similarities = torch.cat(similarity_rows)
+        
+        # Shape-hint refinement stays per element
+        results = []
+        for i, element_data in enumerate(elements):
+            with span('classify_element', index=i, bbox=list(element_data['bbox'])) as args:
+                result = self._classify_from_similarities(similarities[i], element_data, drawing_context)
+                args.update(label=result['label'], confidence=round(float(result['confidence']), 4))
+            results.append(result)
+        return results
+    
     def _analyze_element_relationships(self, classifications: List[Dict]) -> List[Dict]:
         """Analyze relationships between classified elements"""
         
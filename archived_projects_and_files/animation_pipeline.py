@@ -0,0 +1,336 @@
+import functools
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from uuid import uuid4
+from PIL import Image
+from sam_element_splitter import PROMPT_MODES, SAMElementSplitter
+from ai_element_classifier import AIElementClassifier
+from smart_animator import SmartAnimator
+from segment_renderer import SegmentRenderer, Timeline
+from metrics import observe_elements, time_stage
+from scene_export import export_scene
+from scene_plan import ScenePlan
+from staged_executor import StagedExecutor
+from tracing import Trace, annotate, span, use_trace
+
+OUTPUT_FORMATS = ('video', 'plan')
+OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend', 'tmp', 'outputs')
+
+# Previews are small enough to encode in-process with the fastest x264 preset
+PREVIEW_CANVAS_SIZE = (426, 240)
+PREVIEW_FPS = 12
+FPS = 24
+
+# Stages scheduled by staged(): model-bound segmentation and CLIP, NumPy-bound scene compilation,
+# and rendering (compositing plus encoding, itself spread across the segment renderer's processes)
+STAGES = ('segment', 'classify', 'compile', 'render')
+DEFAULT_STAGE_WORKERS = {'segment': 1, 'classify': 1, 'compile': 2, 'render': 2}
+
+
+def stage_workers_from_env() -> Dict[str, int]:
+    """
+    Per-stage thread counts from STAGE_WORKERS_<STAGE> (e.g. STAGE_WORKERS_RENDER=4)
+    Extra segment threads overlap decoding and mask post-processing only: SAM mask generation
+    is serialized per backbone, since its predictor holds one image embedding at a time
+    """
+    return {
+        stage: int(os.environ.get(f'STAGE_WORKERS_{stage.upper()}', DEFAULT_STAGE_WORKERS[stage]))
+        for stage in STAGES
+    }
+
+
+class PipelineError(Exception):
+    """Request-level failure with the HTTP status it maps to"""
+
+    def __init__(self, message: str, status: int = 500):
+        super().__init__(message)
+        self.status = status
+
+
+class AnimationPipeline:
+    """
+    Drawing to animation: segmentation, classification, scene compilation, then video or plan output
+    Shared by the synchronous /animate route and the job workers; each stage is a separate method
+    so callers can schedule them independently
+    """
+
+    def __init__(self, sam_splitter: SAMElementSplitter, ai_classifier: AIElementClassifier,
+                 smart_animator: SmartAnimator, segment_renderer: SegmentRenderer,
+                 preview_renderer: SegmentRenderer, output_dir: str = OUTPUT_DIR,
+                 sprite_cache_bytes: int = 64 * 1024 * 1024, queued_render_threads: int = 1):
+        self.sam_splitter = sam_splitter
+        self.ai_classifier = ai_classifier
+        self.smart_animator = smart_animator
+        self.segment_renderer = segment_renderer
+        self.preview_renderer = preview_renderer
+        self.output_dir = output_dir
+        self.sprite_cache_bytes = sprite_cache_bytes
+        # Full-quality renders queued behind a preview run here, one at a time by default
+        self.full_render_executor = ThreadPoolExecutor(max_workers=queued_render_threads)
+
+    @classmethod
+    def from_env(cls, output_dir: str = OUTPUT_DIR) -> 'AnimationPipeline':
+        """Build the pipeline components from the deployment's environment variables"""
+        # SAM backbones load lazily on first request; SAM_MODEL_TYPE picks the deployment default
+        sam_splitter = SAMElementSplitter(
+            cache_dir=os.environ.get('SEGMENTATION_CACHE_DIR'),
+            default_model_type=os.environ.get('SAM_MODEL_TYPE', 'vit_h'),
+            max_loaded_models=int(os.environ.get('SAM_MAX_LOADED_MODELS', '2')),
+            prompt_mode=os.environ.get('SAM_PROMPT_MODE', 'auto'),
+            hierarchy_mode=os.environ.get('SAM_HIERARCHY_MODE', 'parents'),
+            # Longest side SAM works at; unset or 0 keeps native resolution
+            working_resolution=int(os.environ.get('SAM_WORKING_RESOLUTION', '0')) or None,
+        )
+        ai_classifier = AIElementClassifier(text_features_cache_dir=os.environ.get('CLIP_TEXT_CACHE_DIR'))
+        title_cache_dir = os.environ.get('TITLE_CARD_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'title_card_cache'))
+        # Frames are composited and encoded in keyframe-aligned segments across worker processes
+        # Intro/outro title cards are encoded once per text and codec profile, then spliced in by stream copy
+        segment_renderer = SegmentRenderer(
+            workers=int(os.environ.get('RENDER_WORKERS', os.cpu_count() or 1)),
+            preset='medium',
+            title_cache_dir=title_cache_dir,
+        )
+        preview_renderer = SegmentRenderer(workers=1, preset='ultrafast', title_cache_dir=title_cache_dir)
+        return cls(
+            sam_splitter,
+            ai_classifier,
+            SmartAnimator(),
+            segment_renderer,
+            preview_renderer,
+            output_dir=output_dir,
+            sprite_cache_bytes=int(os.environ.get('SPRITE_TRANSFORM_CACHE_MB', '64')) * 1024 * 1024,
+            queued_render_threads=int(os.environ.get('QUEUED_RENDER_THREADS', '1')),
+        )
+
+    def parse_options(self, data: Optional[Dict]) -> Dict:
+        """Validate request JSON into pipeline options; raises PipelineError with a 400/404 status"""
+        data = data or {}
+        image_path = data.get('image_path')
+        if not image_path:
+            raise PipelineError('Missing image_path', 400)
+
+        options = {
+            'image_path': os.path.abspath(image_path),
+            'user_story': data.get('user_story', None),
+            'quality': data.get('quality', None), # 'fast', 'interactive', 'balanced' or 'high_quality'
+            'prompt_mode': data.get('prompt_mode', None), # 'auto' (point grid) or 'boxes'
+            'loop': bool(data.get('loop', False)), # One seamless cycle of the scene for looped web playback
+            'preview': bool(data.get('preview', False)), # Fast low-resolution render
+            'queue_full_render': bool(data.get('queue_full_render', False)), # With preview: also render full quality afterwards
+            'output_format': data.get('output_format', 'video'), # 'video' (H.264) or 'plan' (scene JSON + sprite atlas)
+            'trace': bool(data.get('trace', False)), # Write a Chrome trace of this request next to the output
+        }
+
+        try:
+            self.sam_splitter.resolve_model_type(tier=options['quality'])
+            if options['prompt_mode'] not in (None,) + PROMPT_MODES:
+                raise ValueError(f"Unknown prompt mode '{options['prompt_mode']}', expected one of {PROMPT_MODES}")
+            if options['output_format'] not in OUTPUT_FORMATS:
+                raise ValueError(f"Unknown output format '{options['output_format']}', expected one of {OUTPUT_FORMATS}")
+        except ValueError as e:
+            raise PipelineError(str(e), 400)
+
+        if not os.path.exists(options['image_path']):
+            raise PipelineError(f"Image not found at {options['image_path']}", 404)
+        return options
+
+    def run(self, options: Dict) -> Dict:
+        """All stages for one request; returns the response payload"""
+        state = self._begin(options)
+        for stage in STAGES:
+            state = self._run_stage(stage, state)
+        return self._finish(state)
+
+    def staged(self, stage_workers: Optional[Dict[str, int]] = None, queue_size: int = 4) -> StagedExecutor:
+        """
+        Executor that runs the stages of concurrent requests in parallel, each stage with its own
+        bounded queue and threads; submit(options) returns a future of the response payload
+        """
+        workers = dict(DEFAULT_STAGE_WORKERS, **(stage_workers or {}))
+        return StagedExecutor([
+            ('segment', lambda options: self._run_stage('segment', self._begin(options)), workers['segment']),
+            ('classify', functools.partial(self._run_stage, 'classify'), workers['classify']),
+            ('compile', functools.partial(self._run_stage, 'compile'), workers['compile']),
+            ('render', lambda state: self._finish(self._run_stage('render', state)), workers['render']),
+        ], queue_size=queue_size)
+
+    def _begin(self, options: Dict) -> Dict:
+        """Per-request state handed from stage to stage, with a trace when options['trace'] is set"""
+        trace = None
+        if options.get('trace'):
+            trace = Trace('animate', image_path=options['image_path'], quality=options['quality'],
+                          prompt_mode=options['prompt_mode'], output_format=options['output_format'],
+                          preview=options['preview'], loop=options['loop'])
+            try:
+                with Image.open(options['image_path']) as image:
+                    trace.annotate(image_width=image.width, image_height=image.height)
+            except Exception:
+                pass
+        return {'options': options, 'trace': trace}
+
+    def _run_stage(self, stage: str, state: Dict) -> Dict:
+        """Run one stage under the request's trace, in whichever thread picks the request up"""
+        options = state['options']
+        try:
+            with use_trace(state['trace']), span(stage):
+                if stage == 'segment':
+                    state['elements'] = self.segment(options)
+                elif stage == 'classify':
+                    state['elements_for_animation'] = self.classify(state.pop('elements'))
+                elif stage == 'compile':
+                    state['scene_plan'] = self.compile(options, state.pop('elements_for_animation'))
+                else:
+                    state['response'] = self.deliver(options, state.pop('scene_plan'))
+        except Exception as e:
+            # Failed requests are often the ones worth tracing
+            if state['trace'] is not None:
+                state['trace'].annotate(error=str(e), failed_stage=stage)
+                self._write_trace(state['trace'], str(uuid4()))
+            raise
+        return state
+
+    def _finish(self, state: Dict) -> Dict:
+        response = state['response']
+        if state['trace'] is not None:
+            # Named after the primary output, e.g. <video>.trace.json next to <video>.mp4
+            output_url = response.get('video_url') or response['plan_url']
+            name = os.path.splitext(os.path.basename(output_url))[0]
+            response['trace_url'] = f"/outputs/{os.path.basename(self._write_trace(state['trace'], name))}"
+        return response
+
+    def _write_trace(self, trace: Trace, name: str) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = trace.write(os.path.join(self.output_dir, f"{name}.trace.json"))
+        print(f"[Flask] Trace written to {path}", file=sys.stderr)
+        return path
+
+    def segment(self, options: Dict) -> List:
+        """Split elements using SAM (or the classical engine for the 'fast' tier)"""
+        print(f"[Flask] Splitting elements for {options['image_path']}", file=sys.stderr)
+        elements = self.sam_splitter.split_drawing_elements(
+            options['image_path'], tier=options['quality'], prompt_mode=options['prompt_mode']
+        )
+        observe_elements(len(elements))
+        # 'fast' resolves to no backbone: the classical splitter
+        annotate(element_count=len(elements),
+                 backbone=self.sam_splitter.resolve_model_type(tier=options['quality']) or 'classical')
+        if not elements:
+            raise PipelineError('No elements found in drawing', 400)
+        return elements
+
+    def classify(self, elements: List) -> List[Dict]:
+        """Classify all elements in one batched CLIP pass, then pair them with their sprites"""
+        with time_stage('clip_classification'):
+            classifications = self.ai_classifier.classify_multiple_elements(elements)
+
+        elements_for_animation = []
+        for element_data, classification_result in zip(elements, classifications):
+            # element_data is a compact ElementRecord from the splitter with 'image' (numpy array), 'bbox', etc.
+            # Sprites keep the segmentation mask as alpha; CLIP above saw the white-filled RGB image
+            elements_for_animation.append({
+                'clip': element_data.rgba(),
+                'classification': classification_result,
+                'info': element_data # Element record from the splitter (no full-frame masks)
+            })
+
+        print(f"[Flask] Classified and prepared {len(elements_for_animation)} elements for animation", file=sys.stderr)
+        return elements_for_animation
+
+    def compile(self, options: Dict, elements_for_animation: List[Dict]) -> ScenePlan:
+        """Compile the scene into a per-frame keyframe table"""
+        print(f"[Flask] Animating scene with {len(elements_for_animation)} elements", file=sys.stderr)
+        with time_stage('scene_compilation'):
+            scene_plan = self.smart_animator.compile_scene(
+                elements_for_animation, options['image_path'], options['user_story'], fps=FPS
+            )
+        # Nothing to render without animated elements
+        if not scene_plan.tracks:
+            raise PipelineError('No animated clips were generated', 500)
+        return scene_plan
+
+    def deliver(self, options: Dict, scene_plan: ScenePlan) -> Dict:
+        """Render or export the scene plan into the output directory; returns URLs relative to the Node.js static server"""
+        # Client-side playback: export the plan and sprite atlas, no video encoding
+        if options['output_format'] == 'plan':
+            paths = export_scene(scene_plan, self.output_dir, str(uuid4()))
+            print(f"[Flask] Scene plan exported to {paths['plan']}", file=sys.stderr)
+            return {
+                'success': True,
+                'plan_url': f"/outputs/{os.path.basename(paths['plan'])}",
+                'atlas_url': f"/outputs/{os.path.basename(paths['atlas'])}",
+                'background_url': f"/outputs/{os.path.basename(paths['background'])}",
+            }
+
+        # Render segments, joined straight into the Node.js static serving directory
+        video_filename = f"{uuid4()}.mp4"
+        final_video_path = os.path.join(self.output_dir, video_filename)
+        loop_output = options['loop']
+        response = {'success': True}
+
+        if options['preview']:
+            # Same scene plan at reduced resolution and frame rate; returns within a few seconds
+            preview_filename = f"{uuid4()}_preview.mp4"
+            preview_path = os.path.join(self.output_dir, preview_filename)
+            print(f"[Flask] Writing preview video to {preview_path}", file=sys.stderr)
+            preview_plan = scene_plan.resampled(PREVIEW_CANVAS_SIZE, PREVIEW_FPS)
+            response['loop'] = self.render_video(self.preview_renderer, preview_plan, preview_path, loop_output)
+            response['video_url'] = f"/outputs/{preview_filename}"
+            response['preview'] = True
+
+            if options['queue_full_render']:
+                # Reuses the in-memory segmentation, classification and scene plan; the file
+                # appears at full_video_url once renamed into place
+                self.full_render_executor.submit(self._render_full_video_in_background, scene_plan,
+                                                 final_video_path, loop_output)
+                response['full_video_url'] = f"/outputs/{video_filename}"
+        else:
+            print(f"[Flask] Writing final video to {final_video_path}", file=sys.stderr)
+            response['loop'] = self.render_video(self.segment_renderer, scene_plan, final_video_path, loop_output)
+            response['video_url'] = f"/outputs/{video_filename}"
+
+        print(f"[Flask] Animation video saved, URL: {response['video_url']}", file=sys.stderr)
+        return response
+
+    def build_timeline(self, scene_plan: ScenePlan) -> Timeline:
+        """Intro and outro title cards are static frames around the main animation"""
+        # Rotated/scaled sprites are cached per request within this memory budget
+        return Timeline(
+            scene_plan,
+            intro_text="Your Drawing Comes to Life!",
+            outro_text="Created by Drawing to Animation",
+            title_seconds=2,
+            transform_cache_bytes=self.sprite_cache_bytes,
+        )
+
+    def render_video(self, renderer: SegmentRenderer, scene_plan: ScenePlan, video_path: str,
+                     loop_output: bool = False) -> bool:
+        """Render a scene plan into video_path; returns True if a seamless loop was written"""
+        timeline = self.build_timeline(scene_plan)
+        with span('render_video', canvas_size=list(scene_plan.canvas_size), fps=scene_plan.fps,
+                  frames=timeline.num_frames, tracks=len(scene_plan.tracks), preset=renderer.preset) as args:
+            if loop_output:
+                try:
+                    renderer.render(timeline, video_path, loop_only=True)
+                    args['loop'] = True
+                    return True
+                except ValueError as e:
+                    print(f"[Flask] {e}; rendering the full video instead", file=sys.stderr)
+            renderer.render(timeline, video_path)
+            args['loop'] = False
+            return False
+
+    def _render_full_video_in_background(self, scene_plan: ScenePlan, video_path: str, loop_output: bool):
+        try:
+            self.render_video(self.segment_renderer, scene_plan, video_path, loop_output)
+            print(f"[Flask] Queued full-quality video saved to {video_path}", file=sys.stderr)
+        except Exception as e:
+            print(f"[Flask] Queued full-quality render failed: {e}", file=sys.stderr)
+
+    def shutdown(self):
+        """Wait for queued full-quality renders, then stop the render worker pools"""
+        self.full_render_executor.shutdown(wait=True)
+        self.segment_renderer.shutdown()
+        self.preview_renderer.shutdown()
@@ -0,0 +1,108 @@
+"""
+Benchmark frame compositing: NumPy SceneCompositor vs MoviePy CompositeVideoClip
+
+Usage:
+    python benchmark_compositor.py [--elements 5 8 12] [--frames 48]
+
+Builds synthetic scenes with typical element sizes and labels, compiles them with
+SmartAnimator.compile_scene and reports per-frame render time for both paths.
+The MoviePy column is skipped when MoviePy is not installed.
+
+Recorded on 1 CPU core with MoviePy 1.0.3, NumPy 2.4, OpenCV 5.0 (--frames 48, 1280x720):
+
+elements |      numpy |    moviepy | speedup
+       5 |     4.65ms |    27.22ms |    5.9x
+       8 |     5.18ms |    31.30ms |    6.0x
+      12 |     5.34ms |    34.95ms |    6.5x
+
+A second run gave 5.2x-6.8x, short of the 10x target. MoviePy 1.0.3 already blits only
+inside each clip's box, which limits what the NumPy path can save per frame.
+"""
+import argparse
+import os
+import tempfile
+import time
+import cv2
+import numpy as np
+from typing import Dict, List
+from scene_compositor import SceneCompositor
+from smart_animator import SmartAnimator
+
+# Mix of behaviors seen in real drawings (rotation, scale, opacity and pure translation)
+SCENE_LABELS = [
+    ('sun', 'background'), ('cloud', 'background'), ('tree', 'midground'), ('house', 'midground'),
+    ('dog', 'foreground'), ('bird', 'foreground'), ('car', 'foreground'), ('flower', 'foreground'),
+    ('star', 'background'), ('person', 'foreground'), ('mountain', 'midground'), ('cat', 'foreground'),
+]
+
+
+def make_scene_elements(count: int, seed: int = 0) -> List[Dict]:
+    """Element dicts shaped like the Flask pipeline's, with 80-260 px sprites"""
+    rng = np.random.default_rng(seed)
+    elements = []
+    for i in range(count):
+        label, layer = SCENE_LABELS[i % len(SCENE_LABELS)]
+        w, h = (int(v) for v in rng.integers(80, 260, size=2))
+        x, y = int(rng.integers(0, 1280 - w)), int(rng.integers(0, 720 - h))
+        sprite = np.full((h, w, 3), 255, dtype=np.uint8)
+        cv2.ellipse(sprite, (w // 2, h // 2), (w // 2 - 2, h // 2 - 2), 0, 0, 360,
+                    tuple(int(c) for c in rng.integers(0, 255, size=3)), -1)
+        elements.append({
+            'clip': sprite,
+            'classification': {'label': label, 'layer': layer},
+            'info': {'image': sprite, 'bbox': (x, y, w, h), 'center': (x + w // 2, y + h // 2), 'area': w * h},
+        })
+    return elements
+
+
+def time_numpy(animator: SmartAnimator, elements: List[Dict], background_path: str, frames: int) -> float:
+    plan = animator.compile_scene(elements, background_path)
+    compositor = SceneCompositor(plan)
+    step = max(1, plan.num_frames // frames)
+    start = time.perf_counter()
+    for frame in range(0, step * frames, step):
+        compositor.render_frame(min(frame, plan.num_frames - 1))
+    return (time.perf_counter() - start) * 1000 / frames
+
+
+def time_moviepy(animator: SmartAnimator, elements: List[Dict], background_path: str, frames: int) -> float:
+    from moviepy.editor import CompositeVideoClip
+    clips = animator.create_coordinated_animation(elements, background_path)
+    composite = CompositeVideoClip(clips, size=animator.canvas_size)
+    times = np.linspace(0, animator.animation_duration, frames, endpoint=False)
+    start = time.perf_counter()
+    for t in times:
+        composite.get_frame(t)
+    return (time.perf_counter() - start) * 1000 / frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--elements', type=int, nargs='+', default=[5, 8, 12])
+    parser.add_argument('--frames', type=int, default=48)
+    args = parser.parse_args()
+
+    animator = SmartAnimator()
+    temp_dir = tempfile.mkdtemp(prefix='compositor_bench_')
+    background_path = os.path.join(temp_dir, 'background.png')
+    paper = np.random.default_rng(0).normal(245, 6, (720, 1280, 3))
+    cv2.imwrite(background_path, np.clip(paper, 0, 255).astype(np.uint8))
+
+    header = f"{'elements':>8} | {'numpy':>10} | {'moviepy':>10} | {'speedup':>7}"
+    print(header)
+    print('-' * len(header))
+    for count in args.elements:
+        elements = make_scene_elements(count, seed=count)
+        numpy_ms = time_numpy(animator, elements, background_path, args.frames)
+        try:
+            moviepy_ms = time_moviepy(animator, elements, background_path, args.frames)
+            print(f"{count:>8} | {numpy_ms:>8.2f}ms | {moviepy_ms:>8.2f}ms | {moviepy_ms / numpy_ms:>6.1f}x")
+        except ImportError:
+            print(f"{count:>8} | {numpy_ms:>8.2f}ms | {'n/a':>10} | {'n/a':>7}")
+
+    os.remove(background_path)
+    os.rmdir(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
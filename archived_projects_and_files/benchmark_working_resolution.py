@@ -0,0 +1,183 @@
+"""
+Benchmark SAM segmentation at native resolution vs a capped working resolution
+
+Usage:
+    python benchmark_working_resolution.py [image ...] [--working-resolution 1024] [--model-type vit_h] [--repeats 3]
+
+Without image paths, synthetic line drawings are generated at typical upload sizes.
+Reports preprocessing and end-to-end latency for both modes, plus mean mask IoU
+of the capped-resolution elements against their best match at native resolution.
+
+Recorded on 1 CPU core without SAM/torch (synthetic drawings, --working-resolution 1024, best of 3);
+totals and IoU there time the classical fallback, so only preprocessing compares the two modes:
+
+       size | pre native | pre capped
+   1280x960 |    262.2ms |    179.4ms
+  2048x1536 |    677.4ms |    155.5ms
+  3024x4032 |   2449.7ms |    199.5ms
+
+End-to-end SAM latency and mask IoU still need a run with SAM checkpoints installed, so
+SAMElementSplitter defaults to native resolution and the cap is opt-in (SAM_WORKING_RESOLUTION).
+Record that run here before making 1024 the default.
+"""
+import argparse
+import os
+import tempfile
+import time
+import cv2
+import numpy as np
+from typing import Dict, List, Tuple
+from sam_element_splitter import SAM_CHECKPOINTS, SAMElementSplitter
+
+# Phone photos and scans we typically receive
+TYPICAL_UPLOAD_SIZES = [(1280, 960), (2048, 1536), (3024, 4032)]
+
+
+def make_synthetic_drawing(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """Draw a child-like scene (sun, house, tree, figures) with thick outlines on white paper"""
+    rng = np.random.default_rng(seed)
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+    unit = min(width, height) / 100.0
+    thickness = max(2, int(unit * 0.6))
+
+    def pt(fx, fy):
+        return int(fx * width), int(fy * height)
+
+    # Sun
+    cv2.circle(image, pt(0.15, 0.15), int(8 * unit), (0, 200, 255), -1)
+    cv2.circle(image, pt(0.15, 0.15), int(8 * unit), (0, 0, 0), thickness)
+    # House with door
+    cv2.rectangle(image, pt(0.4, 0.45), pt(0.65, 0.8), (60, 60, 200), -1)
+    cv2.rectangle(image, pt(0.4, 0.45), pt(0.65, 0.8), (0, 0, 0), thickness)
+    cv2.rectangle(image, pt(0.5, 0.62), pt(0.56, 0.8), (30, 90, 140), -1)
+    # Tree
+    cv2.rectangle(image, pt(0.78, 0.55), pt(0.82, 0.8), (40, 80, 120), -1)
+    cv2.circle(image, pt(0.8, 0.45), int(9 * unit), (60, 170, 60), -1)
+    # Clouds and figures at random positions
+    for _ in range(3):
+        cx, cy = rng.uniform(0.3, 0.9), rng.uniform(0.08, 0.25)
+        cv2.ellipse(image, pt(cx, cy), (int(9 * unit), int(4 * unit)), 0, 0, 360, (220, 220, 220), -1)
+    for _ in range(2):
+        cx = rng.uniform(0.1, 0.35)
+        cv2.circle(image, pt(cx, 0.6), int(3 * unit), (0, 0, 0), thickness)
+        cv2.line(image, pt(cx, 0.64), pt(cx, 0.78), (0, 0, 0), thickness)
+
+    # Paper texture / sensor noise as in real photos
+    noise = rng.normal(0, 4, image.shape)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+
+def full_frame_masks(elements: List[Dict], shape: Tuple[int, int]) -> List[np.ndarray]:
+    """Paste each element's bbox-cropped mask back into a full-frame boolean mask"""
+    masks = []
+    for element in elements:
+        x, y, w, h = element['bbox']
+        full = np.zeros(shape, dtype=bool)
+        full[y:y+h, x:x+w] = element['mask']
+        masks.append(full)
+    return masks
+
+
+def mean_best_iou(reference: List[np.ndarray], candidates: List[np.ndarray]) -> float:
+    """Mean over reference masks of the best IoU against any candidate mask"""
+    if not reference or not candidates:
+        return 0.0
+
+    scores = []
+    for ref in reference:
+        best = 0.0
+        for cand in candidates:
+            union = np.logical_or(ref, cand).sum()
+            if union:
+                best = max(best, np.logical_and(ref, cand).sum() / union)
+        scores.append(best)
+    return float(np.mean(scores))
+
+
+def time_call(fn, repeats: int) -> Tuple[float, object]:
+    """Best-of-N wall clock in milliseconds, plus the last result"""
+    best = float('inf')
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, (time.perf_counter() - start) * 1000)
+    return best, result
+
+
+def benchmark_image(splitter: SAMElementSplitter, image_path: str, working_resolution: int,
+                    model_type: str, repeats: int) -> Dict:
+    image_rgb = cv2.cvtColor(cv2.imread(image_path), cv2.COLOR_BGR2RGB)
+    height, width = image_rgb.shape[:2]
+
+    splitter.working_resolution = None
+    native_pre_ms, _ = time_call(lambda: splitter._preprocess_for_sam(image_rgb), repeats)
+    native_ms, native_elements = time_call(
+        lambda: splitter.split_drawing_elements(image_path, model_type=model_type), repeats
+    )
+
+    splitter.working_resolution = working_resolution
+    capped_pre_ms, _ = time_call(
+        lambda: splitter._preprocess_for_sam(splitter._resize_to_working_resolution(image_rgb)[0]), repeats
+    )
+    capped_ms, capped_elements = time_call(
+        lambda: splitter.split_drawing_elements(image_path, model_type=model_type), repeats
+    )
+
+    iou = mean_best_iou(
+        full_frame_masks(native_elements, (height, width)),
+        full_frame_masks(capped_elements, (height, width)),
+    )
+
+    return {
+        'size': f"{width}x{height}",
+        'native_pre_ms': native_pre_ms,
+        'capped_pre_ms': capped_pre_ms,
+        'native_ms': native_ms,
+        'capped_ms': capped_ms,
+        'native_elements': len(native_elements),
+        'capped_elements': len(capped_elements),
+        'mask_iou': iou,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='*', help='Drawings to benchmark (default: synthetic typical sizes)')
+    parser.add_argument('--working-resolution', type=int, default=1024)
+    parser.add_argument('--model-type', default='vit_h', choices=list(SAM_CHECKPOINTS))
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    splitter = SAMElementSplitter()
+    if splitter._get_mask_generator(args.model_type) is None:
+        print("⚠️ SAM is not available; only preprocessing latency is meaningful")
+
+    image_paths = list(args.images)
+    temp_dir = None
+    if not image_paths:
+        temp_dir = tempfile.mkdtemp(prefix='sam_bench_')
+        for i, (width, height) in enumerate(TYPICAL_UPLOAD_SIZES):
+            path = os.path.join(temp_dir, f"synthetic_{width}x{height}.png")
+            cv2.imwrite(path, make_synthetic_drawing(width, height, seed=i))
+            image_paths.append(path)
+
+    header = (f"{'size':>11} | {'pre native':>10} | {'pre capped':>10} | {'total native':>12} | "
+              f"{'total capped':>12} | {'speedup':>7} | {'elements':>8} | {'mask IoU':>8}")
+    print(header)
+    print('-' * len(header))
+    for image_path in image_paths:
+        row = benchmark_image(splitter, image_path, args.working_resolution, args.model_type, args.repeats)
+        speedup = row['native_ms'] / row['capped_ms'] if row['capped_ms'] else float('nan')
+        print(f"{row['size']:>11} | {row['native_pre_ms']:>8.1f}ms | {row['capped_pre_ms']:>8.1f}ms | "
+              f"{row['native_ms']:>10.1f}ms | {row['capped_ms']:>10.1f}ms | {speedup:>6.1f}x | "
+              f"{row['native_elements']:>3}/{row['capped_elements']:<4} | {row['mask_iou']:>8.3f}")
+
+    if temp_dir:
+        for name in os.listdir(temp_dir):
+            os.remove(os.path.join(temp_dir, name))
+        os.rmdir(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
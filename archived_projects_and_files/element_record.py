@@ -0,0 +1,98 @@
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+class ElementRecord:
+    """
+    Compact segmented element: bbox-cropped image plus a bit-packed bbox-cropped mask
+    Supports dict-style access (record['bbox'], record.get('area')) so existing pipeline code keeps working
+    """
+
+    __slots__ = (
+        'type', 'image', 'packed_mask', 'mask_shape', 'bbox', 'center', 'area',
+        'stability_score', 'predicted_iou', 'aspect_ratio', 'parent', 'children',
+    )
+
+    # Keys visible through the mapping interface ('mask' is unpacked on demand)
+    KEYS = (
+        'type', 'image', 'mask', 'bbox', 'center', 'area',
+        'stability_score', 'predicted_iou', 'aspect_ratio', 'parent', 'children',
+    )
+
+    def __init__(self, element_type: str, image: np.ndarray, mask: Optional[np.ndarray],
+                 bbox: Tuple[int, int, int, int], area: int, stability_score: float = 1.0, predicted_iou: float = 1.0,
+                 aspect_ratio: Optional[float] = None, center: Optional[Tuple[int, int]] = None,
+                 parent: Optional[str] = None, children: Optional[List[str]] = None,
+                 packed_mask: Optional[np.ndarray] = None, mask_shape: Optional[Tuple[int, int]] = None):
+        x, y, w, h = (int(v) for v in bbox)
+        self.type = element_type
+        self.image = image
+        self.bbox = (x, y, w, h)
+        self.center = tuple(int(v) for v in center) if center is not None else (x + w//2, y + h//2)
+        self.area = int(area)
+        self.stability_score = float(stability_score)
+        self.predicted_iou = float(predicted_iou)
+        self.aspect_ratio = float(aspect_ratio) if aspect_ratio is not None else (w / h if h > 0 else 1.0)
+        self.parent = parent
+        self.children = list(children) if children else []
+
+        if packed_mask is not None:
+            self.packed_mask = packed_mask
+            self.mask_shape = tuple(int(v) for v in mask_shape)
+        else:
+            mask = np.asarray(mask, dtype=bool)
+            self.packed_mask = np.packbits(mask, axis=None)
+            self.mask_shape = mask.shape
+
+    @property
+    def mask(self) -> np.ndarray:
+        """Boolean bbox-cropped mask, unpacked from its bit-packed form"""
+        height, width = self.mask_shape
+        return np.unpackbits(self.packed_mask, count=height * width).reshape(height, width).astype(bool)
+
+    def rgba(self) -> np.ndarray:
+        """
+        Bbox-cropped RGBA sprite with the mask as alpha (the RGB image keeps its white fill for CLIP)
+        Color outside the mask is zeroed, so with a binary mask the sprite is also premultiplied
+        and filtering never picks up the paper's white
+        """
+        mask = self.mask
+        rgba = np.zeros(self.image.shape[:2] + (4,), dtype=np.uint8)
+        rgba[mask, :3] = self.image[mask, :3]
+        rgba[:, :, 3] = mask * np.uint8(255)
+        return rgba
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the record's arrays"""
+        return self.image.nbytes + self.packed_mask.nbytes
+
+    def __getitem__(self, key: str):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.KEYS
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in self.KEYS else default
+
+    def keys(self):
+        return self.KEYS
+
+    def scalar_fields(self) -> Dict:
+        """JSON-serializable fields (everything except the arrays)"""
+        return {
+            'type': self.type,
+            'bbox': list(self.bbox),
+            'center': list(self.center),
+            'area': self.area,
+            'stability_score': self.stability_score,
+            'predicted_iou': self.predicted_iou,
+            'aspect_ratio': self.aspect_ratio,
+            'parent': self.parent,
+            'children': list(self.children),
+        }
+
+    def __repr__(self):
+        return f"ElementRecord({self.type!r}, bbox={self.bbox}, area={self.area})"
@@ -0,0 +1,145 @@
+import cv2
+import numpy as np
+from typing import List, Optional
+from element_record import ElementRecord
+
+class FastElementSplitter:
+    """
+    CPU-fast classical element splitter for clean drawings on light paper
+    Thresholding + connected components, producing the same element records as SAMElementSplitter
+    """
+
+    def __init__(self, max_elements: int = 12, min_area: int = 1000, max_area_ratio: float = 0.6,
+                 working_resolution: Optional[int] = 1024):
+        self.max_elements = max_elements
+        self.min_area = min_area
+        self.max_area_ratio = max_area_ratio
+        # Longest side used for thresholding and labelling (None = native resolution)
+        self.working_resolution = working_resolution
+
+    def split_drawing_elements(self, image_path: str) -> List[ElementRecord]:
+        """Split a drawing into elements without any neural model"""
+        print("⚡ Analyzing drawing with fast classical segmentation...")
+
+        image = cv2.imread(image_path)
+        if image is None:
+            print(f"⚠️ Could not load image: {image_path}")
+            return []
+
+        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        elements = self.split_image(image_rgb)
+
+        print(f"✅ Fast segmentation found {len(elements)} elements")
+        return elements
+
+    def split_image(self, image_rgb: np.ndarray, limit: Optional[int] = None) -> List[ElementRecord]:
+        """Segment an RGB image already in memory"""
+        limit = self.max_elements if limit is None else limit
+        labels, stats, candidate_labels, scale = self._rank_components(image_rgb, limit)
+
+        elements = []
+        for label in candidate_labels:
+            mask, (bx, by, bw, bh) = self._component_mask(labels, stats[label], label, scale, image_rgb.shape)
+            barea = int(mask.sum())
+
+            element_img = image_rgb[by:by+bh, bx:bx+bw].copy()
+            element_img[~mask] = 255
+
+            extent = barea / float(bw * bh)
+            elements.append(ElementRecord(
+                f'fast_segment_{label}',
+                image=element_img,
+                mask=mask,
+                bbox=(bx, by, bw, bh),
+                area=barea,
+                # No model confidence here: extent and solidity stand in for SAM's scores
+                stability_score=extent,
+                predicted_iou=self._solidity(mask, barea),
+            ))
+
+        return elements
+
+    def propose_boxes(self, image_rgb: np.ndarray, limit: int) -> np.ndarray:
+        """Candidate element boxes as an (N, 4) array of x, y, w, h in image coordinates, largest first"""
+        _, stats, candidate_labels, scale = self._rank_components(image_rgb, limit)
+        boxes = stats[candidate_labels, :4].astype(np.float64) / scale
+        return np.round(boxes).astype(np.int64)
+
+    def _rank_components(self, image_rgb: np.ndarray, limit: int):
+        """Label the drawing and return (labels, stats, ranked candidate labels, working scale)"""
+        img_height, img_width = image_rgb.shape[:2]
+
+        # Label a downscaled copy; stats are scaled back to original pixels
+        scale = 1.0
+        working_image = image_rgb
+        if self.working_resolution and max(img_height, img_width) > self.working_resolution:
+            scale = self.working_resolution / max(img_height, img_width)
+            working_size = (max(1, round(img_width * scale)), max(1, round(img_height * scale)))
+            working_image = cv2.resize(image_rgb, working_size, interpolation=cv2.INTER_AREA)
+
+        filled = self._foreground_mask(working_image)
+        _, labels, stats, _ = cv2.connectedComponentsWithStats(filled, connectivity=8)
+
+        # Filter every component at once on its stats row (label 0 is the paper)
+        w = stats[1:, cv2.CC_STAT_WIDTH] / scale
+        h = stats[1:, cv2.CC_STAT_HEIGHT] / scale
+        area = stats[1:, cv2.CC_STAT_AREA] / (scale * scale)
+        aspect_ratio = w / np.maximum(h, 1)
+        keep = (
+            (area >= self.min_area) &
+            (area <= img_height * img_width * self.max_area_ratio) &
+            (w >= 10) & (h >= 10) &
+            (aspect_ratio <= 10) & (aspect_ratio >= 0.1)
+        )
+        candidate_labels = np.nonzero(keep)[0] + 1
+
+        # Largest components first; only the survivors are ever cropped
+        order = np.argsort(-stats[candidate_labels, cv2.CC_STAT_AREA], kind='stable')
+        return labels, stats, candidate_labels[order][:limit], scale
+
+    def _component_mask(self, labels: np.ndarray, stat_row: np.ndarray, label: int, scale: float, img_shape):
+        """Bbox-cropped boolean mask of one component in original coordinates, plus its bbox"""
+        sx, sy, sw, sh = (int(v) for v in stat_row[:4])
+        small = labels[sy:sy+sh, sx:sx+sw] == label
+        if scale == 1.0:
+            return small, (sx, sy, sw, sh)
+
+        img_height, img_width = img_shape[:2]
+        bx = min(int(round(sx / scale)), img_width - 1)
+        by = min(int(round(sy / scale)), img_height - 1)
+        bw = max(1, min(int(round(sw / scale)), img_width - bx))
+        bh = max(1, min(int(round(sh / scale)), img_height - by))
+
+        upsampled = cv2.resize(small.astype(np.uint8) * 255, (bw, bh), interpolation=cv2.INTER_LINEAR)
+        return upsampled > 127, (bx, by, bw, bh)
+
+    def _foreground_mask(self, image_rgb: np.ndarray) -> np.ndarray:
+        """Binary mask of inked regions with enclosed areas filled in"""
+        gray = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2GRAY)
+        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+
+        # Ink is darker than paper; Otsu adapts to pencil vs marker
+        _, ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+        # Close small gaps in strokes so outlines become closed shapes
+        kernel_size = max(3, (min(gray.shape) // 200) | 1)
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
+        ink = cv2.morphologyEx(ink, cv2.MORPH_CLOSE, kernel)
+
+        # Fill regions enclosed by strokes: flood the paper from the border, the rest is inside
+        padded = cv2.copyMakeBorder(ink, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+        flood = padded.copy()
+        flood_mask = np.zeros((padded.shape[0] + 2, padded.shape[1] + 2), dtype=np.uint8)
+        cv2.floodFill(flood, flood_mask, (0, 0), 255)
+        filled = padded | cv2.bitwise_not(flood)
+
+        return filled[1:-1, 1:-1]
+
+    def _solidity(self, mask: np.ndarray, area: int) -> float:
+        """Component area over its convex hull area (1.0 for convex shapes)"""
+        contours, _ = cv2.findContours(mask.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            return 0.0
+
+        hull_area = cv2.contourArea(cv2.convexHull(np.vstack(contours)))
+        return float(min(1.0, area / hull_area)) if hull_area > 0 else 0.0
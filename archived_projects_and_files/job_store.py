@@ -0,0 +1,182 @@
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional
+from uuid import uuid4
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    """Whether a process with this pid exists on this host (the store is a local file, so workers are local)"""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, owned by another user
+        return True
+    return True
+
+
+class JobStore:
+    """
+    Durable animation job queue in a local SQLite database
+    Jobs move queued -> running -> succeeded | failed; params and results are stored as JSON
+    Safe to share between the web process and any number of worker processes on the same host;
+    jobs are claimed with an IMMEDIATE transaction so each one runs in exactly one worker.
+    A claim is a lease: workers heartbeat their running jobs, and a job whose heartbeat is older
+    than lease_seconds is treated as orphaned even if its worker pid has been reused
+    """
+
+    def __init__(self, db_path: str, max_attempts: int = 3, lease_seconds: float = 60):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            # WAL lets status polls read while a worker is writing
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker_pid INTEGER,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    heartbeat_at REAL
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)')
+            # Stores created before claims were leased
+            conn.execute('BEGIN IMMEDIATE')
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+            if 'heartbeat_at' not in columns:
+                conn.execute('ALTER TABLE jobs ADD COLUMN heartbeat_at REAL')
+            conn.execute('COMMIT')
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per operation: connections are not shared across threads or processes
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def create(self, params: Dict) -> str:
+        """Queue a job; returns its ID"""
+        job_id = str(uuid4())
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, status, params, created_at) VALUES (?, ?, ?, ?)',
+                (job_id, 'queued', json.dumps(params), time.time()),
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def claim(self, worker_pid: int) -> Optional[Dict]:
+        """Atomically move the oldest queued job to running; None when the queue is empty"""
+        with self._connect() as conn:
+            # Take the write lock before reading so two workers never pick the same row
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    conn.execute('COMMIT')
+                    return None
+                now = time.time()
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', worker_pid = ?, started_at = ?, heartbeat_at = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    (worker_pid, now, now, row['id']),
+                )
+                job = conn.execute('SELECT * FROM jobs WHERE id = ?', (row['id'],)).fetchone()
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return self._to_dict(job)
+
+    def heartbeat(self, worker_pid: int, job_ids: Iterable[str]):
+        """Renew the lease on jobs this worker is still running (not ones since requeued to another)"""
+        now = time.time()
+        rows = [(now, job_id, worker_pid) for job_id in job_ids]
+        if not rows:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND worker_pid = ? AND status = 'running'",
+                rows,
+            )
+
+    def complete(self, job_id: str, result: Dict):
+        self._finish(job_id, 'succeeded', result=json.dumps(result))
+
+    def fail(self, job_id: str, error: str):
+        self._finish(job_id, 'failed', error=error)
+
+    def _finish(self, job_id: str, status: str, result: Optional[str] = None, error: Optional[str] = None):
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?',
+                (status, result, error, time.time(), job_id),
+            )
+
+    def recover(self) -> int:
+        """
+        Requeue running jobs whose worker process no longer exists or whose lease has expired
+        Workers of any pool on this host may share the store, so liveness is checked per pid rather
+        than against one pool's own processes; after a restart pids repeat, so a job is also orphaned
+        once its heartbeat is older than lease_seconds. Jobs that already used max_attempts fail
+        instead, so a crashing input cannot loop forever. Returns the number of jobs touched
+        """
+        expired = time.time() - self.lease_seconds
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = conn.execute(
+                    "SELECT id, attempts, worker_pid, COALESCE(heartbeat_at, started_at) AS heartbeat_at "
+                    "FROM jobs WHERE status = 'running'"
+                ).fetchall()
+                orphaned = [
+                    row for row in rows
+                    if not _pid_alive(row['worker_pid']) or (row['heartbeat_at'] or 0) < expired
+                ]
+                for row in orphaned:
+                    if row['attempts'] >= self.max_attempts:
+                        conn.execute(
+                            "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                            (f"Worker exited during the job {row['attempts']} times", time.time(), row['id']),
+                        )
+                    else:
+                        conn.execute(
+                            "UPDATE jobs SET status = 'queued', worker_pid = NULL, started_at = NULL, "
+                            "heartbeat_at = NULL WHERE id = ?",
+                            (row['id'],),
+                        )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return len(orphaned)
+
+    def _to_dict(self, row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
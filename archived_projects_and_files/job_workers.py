@@ -0,0 +1,161 @@
+import functools
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import List, Optional
+from animation_pipeline import OUTPUT_DIR, AnimationPipeline, PipelineError, stage_workers_from_env
+from job_store import JobStore
+from metrics import registry
+
+DEFAULT_JOB_DB_PATH = os.path.join(os.path.dirname(OUTPUT_DIR), 'jobs.sqlite3')
+
+
+def _finish_job(store: JobStore, job_id: str, slots: threading.Semaphore, in_flight: set, future):
+    """Record a staged pipeline result in the store and free the worker's slot"""
+    try:
+        error = future.exception()
+        if error is None:
+            store.complete(job_id, future.result())
+            print(f"[Jobs] Job {job_id} succeeded", file=sys.stderr)
+        elif isinstance(error, PipelineError):
+            store.fail(job_id, str(error))
+            print(f"[Jobs] Job {job_id} failed: {error}", file=sys.stderr)
+        else:
+            traceback.print_exception(type(error), error, error.__traceback__, file=sys.stderr)
+            store.fail(job_id, f"An unexpected error occurred: {error}")
+    finally:
+        in_flight.discard(job_id)
+        registry.flush()
+        slots.release()
+
+
+def _worker_main(db_path: str, output_dir: str, poll_interval: float, stop_event):
+    """Worker process: claim queued jobs and feed them through the staged pipeline until stopped"""
+    store = JobStore(db_path)
+    # Each worker loads its own models; SAM and CLIP load lazily on the first job
+    pipeline = AnimationPipeline.from_env(output_dir)
+    # Consecutive jobs overlap: one can be segmenting while an earlier one renders
+    stages = pipeline.staged(stage_workers_from_env())
+    # Claim only as many jobs as the stages can work on, leaving the rest to other workers
+    slots = threading.Semaphore(stages.capacity)
+    # Claimed jobs whose lease this worker renews until they finish
+    in_flight = set()
+    last_heartbeat = time.monotonic()
+    pid = os.getpid()
+    print(f"[Jobs] Worker {pid} ready ({stages.capacity} jobs in flight)", file=sys.stderr)
+
+    try:
+        while not stop_event.is_set():
+            if time.monotonic() - last_heartbeat >= store.lease_seconds / 4:
+                store.heartbeat(pid, list(in_flight))
+                last_heartbeat = time.monotonic()
+            if not slots.acquire(timeout=poll_interval):
+                continue
+            job = store.claim(pid)
+            if job is None:
+                slots.release()
+                stop_event.wait(poll_interval)
+                continue
+
+            print(f"[Jobs] Worker {pid} running job {job['id']} (attempt {job['attempts']})", file=sys.stderr)
+            in_flight.add(job['id'])
+            future = stages.submit(job['params'])
+            future.add_done_callback(functools.partial(_finish_job, store, job['id'], slots, in_flight))
+    finally:
+        # Jobs already claimed run to completion before the worker exits; keep their leases alive meanwhile
+        draining = threading.Thread(target=stages.shutdown, name='job-drain')
+        draining.start()
+        while draining.is_alive():
+            store.heartbeat(pid, list(in_flight))
+            draining.join(store.lease_seconds / 4)
+        pipeline.shutdown()
+
+
+class JobWorkerPool:
+    """
+    Fixed-size pool of worker processes draining a JobStore
+    A monitor thread replaces workers that die and requeues the jobs they held, and periodically
+    requeues jobs whose lease expired (e.g. claimed before a restart by a pid that now exists again)
+    """
+
+    def __init__(self, db_path: str = DEFAULT_JOB_DB_PATH, workers: int = 1, output_dir: str = OUTPUT_DIR,
+                 poll_interval: float = 0.5):
+        self.db_path = db_path
+        self.workers = max(1, workers)
+        self.output_dir = output_dir
+        self.poll_interval = poll_interval
+        self.store = JobStore(db_path)
+
+        # Spawned, not forked: the parent may hold model threads and an open HTTP server
+        self._context = multiprocessing.get_context('spawn')
+        self._stop_event = self._context.Event()
+        self._processes: List[multiprocessing.Process] = []
+        self._monitor: Optional[threading.Thread] = None
+
+    def start(self):
+        # Jobs left 'running' by workers that no longer exist were interrupted by a restart or crash;
+        # jobs held by live workers of another pool on this host are left alone
+        recovered = self.store.recover()
+        if recovered:
+            print(f"[Jobs] Requeued {recovered} interrupted job(s)", file=sys.stderr)
+
+        self._processes = [self._spawn() for _ in range(self.workers)]
+        self._monitor = threading.Thread(target=self._watch, name='job-pool-monitor', daemon=True)
+        self._monitor.start()
+        print(f"[Jobs] Started {self.workers} worker process(es) on {self.db_path}", file=sys.stderr)
+
+    def _spawn(self) -> multiprocessing.Process:
+        # Not daemonic: workers start their own render process pools
+        process = self._context.Process(
+            target=_worker_main,
+            args=(self.db_path, self.output_dir, self.poll_interval, self._stop_event),
+            name='animation-job-worker',
+        )
+        process.start()
+        return process
+
+    def _watch(self):
+        last_recover = time.monotonic()
+        while not self._stop_event.wait(self.poll_interval * 4):
+            if time.monotonic() - last_recover >= self.store.lease_seconds / 2:
+                last_recover = time.monotonic()
+                recovered = self.store.recover()
+                if recovered:
+                    print(f"[Jobs] Requeued {recovered} job(s) with an expired lease", file=sys.stderr)
+            dead = [p for p in self._processes if not p.is_alive()]
+            if not dead:
+                continue
+            for process in dead:
+                print(f"[Jobs] Worker {process.pid} exited with code {process.exitcode}; restarting", file=sys.stderr)
+                self._processes.remove(process)
+            # is_alive() has reaped the dead workers, so their pids no longer exist
+            self.store.recover()
+            self._processes += [self._spawn() for _ in dead]
+
+    def stop(self, timeout: float = 120):
+        """Let workers finish their claimed jobs, then terminate any that do not exit in time"""
+        self._stop_event.set()
+        if self._monitor is not None:
+            self._monitor.join()
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self._processes = []
+
+
+if __name__ == '__main__':
+    # Standalone workers for a separately served API: python job_workers.py
+    pool = JobWorkerPool(
+        db_path=os.environ.get('JOB_DB_PATH', DEFAULT_JOB_DB_PATH),
+        workers=int(os.environ.get('JOB_WORKERS', '1')),
+    )
+    pool.start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pool.stop()
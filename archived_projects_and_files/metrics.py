@@ -0,0 +1,318 @@
+import fcntl
+import json
+import multiprocessing.util
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Tuple
+
+# Seconds: from a cached image decode up to a full-quality render
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+ELEMENT_BUCKETS = (0, 1, 2, 4, 8, 12, 16, 24, 32, 48, 64)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'animation_stage_seconds': ('histogram', 'Time spent in each pipeline stage', STAGE_BUCKETS),
+    'animation_elements_per_request': ('histogram', 'Elements segmented from each drawing', ELEMENT_BUCKETS),
+    'animation_elements_total': ('counter', 'Elements segmented across all drawings', None),
+    'animation_cache_requests_total': ('counter', 'Cache lookups by cache and result', None),
+    'animation_fallbacks_total': ('counter', 'Degraded code paths taken, by reason', None),
+}
+
+# Every process (web server, job workers, render workers) snapshots its metrics here;
+# /metrics sums the snapshots
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'animation_metrics'))
+# Totals of processes that have exited, so counters never go backwards when a worker is replaced
+RETIRED_SNAPSHOT = 'metrics_retired.json'
+
+
+def _label_key(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    labels = list(labels)
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _merge(snapshots: Iterable[Dict]) -> Tuple[Dict, Dict]:
+    """Sum snapshots into counters {(name, labels): value} and histograms {(name, labels): entry}"""
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, _label_key(labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, bucket_counts, total, count in snapshot['histograms']:
+            key = (name, _label_key(labels))
+            entry = histograms.setdefault(key, [[0] * len(bucket_counts), 0.0, 0])
+            entry[0] = [a + b for a, b in zip(entry[0], bucket_counts)]
+            entry[1] += total
+            entry[2] += count
+    return counters, histograms
+
+
+def _to_snapshot(counters: Dict, histograms: Dict) -> Dict:
+    return {
+        'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, dict(labels), list(entry[0]), entry[1], entry[2]]
+                       for (name, labels), entry in histograms.items()],
+    }
+
+
+def _read_snapshot(path: str) -> Optional[Dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_snapshot(path: str, snapshot: Dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+
+def _owner_alive(alive_path: str) -> bool:
+    """A live process holds a lock on its .alive file; the lock goes away with the process, whatever its pid"""
+    try:
+        with open(alive_path, 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            return False
+    except OSError:
+        return False
+
+
+class MetricsRegistry:
+    """
+    In-process counters and histograms for the METRICS table, rendered in Prometheus text format
+    Values are periodically written to <snapshot_dir>/metrics_<pid>-<token>.json so the web process
+    can report work done in worker processes as well; at exit a process folds its totals into
+    the retired snapshot and removes its own file
+    """
+
+    def __init__(self, snapshot_dir: Optional[str] = METRICS_DIR, flush_interval: float = 1.0):
+        self.snapshot_dir = snapshot_dir
+        self.flush_interval = flush_interval
+        self._counters: Dict[Tuple, float] = {}
+        # (name, labels) -> [per-bucket counts (last is +Inf), sum, count]
+        self._histograms: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+        # Per-process snapshot name and the open .alive file whose lock marks this process as live
+        self._instance: Optional[str] = None
+        self._instance_pid: Optional[int] = None
+        self._alive_file = None
+        self._retired = False
+        # Stage threads flush concurrently; one writer at a time per process
+        self._flush_lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._maybe_flush()
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = METRICS[name][2]
+        key = (name, _label_key(labels))
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                entry = self._histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+        self._maybe_flush()
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return _to_snapshot(self._counters, self._histograms)
+
+    def _maybe_flush(self):
+        if self.snapshot_dir and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    @contextmanager
+    def _dir_lock(self, exclusive: bool = False):
+        """Readers share the snapshot directory; folding snapshots into the retired totals is exclusive"""
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        with open(os.path.join(self.snapshot_dir, 'metrics.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def _path(self, instance: str, suffix: str = '.json') -> str:
+        return os.path.join(self.snapshot_dir, f"metrics_{instance}{suffix}")
+
+    def _ensure_instance(self) -> str:
+        """Name this process's snapshot and mark it live; the pid alone could be reused by a later process"""
+        if self._instance_pid != os.getpid():
+            self._instance = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+            self._instance_pid = os.getpid()
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            self._alive_file = open(self._path(self._instance, '.alive'), 'a')
+            fcntl.flock(self._alive_file, fcntl.LOCK_EX)
+            # atexit does not run in multiprocessing children; their finalizers do, as do the main process's
+            multiprocessing.util.Finalize(None, self.retire, exitpriority=0)
+        return self._instance
+
+    def _fold_into_retired(self, snapshot: Dict):
+        # Caller holds the directory lock exclusively
+        retired_path = os.path.join(self.snapshot_dir, RETIRED_SNAPSHOT)
+        retired = _read_snapshot(retired_path)
+        _write_snapshot(retired_path, _to_snapshot(*_merge([snapshot] + ([retired] if retired else []))))
+
+    def flush(self):
+        """Write this process's snapshot; call before a worker goes idle so nothing is left unreported"""
+        if not self.snapshot_dir or self._retired:
+            return
+        self._last_flush = time.monotonic()
+        try:
+            with self._flush_lock:
+                if not self._retired:
+                    _write_snapshot(self._path(self._ensure_instance()), self.snapshot())
+        except OSError as e:
+            print(f"⚠️ Could not write metrics snapshot: {e}")
+
+    def retire(self):
+        """Fold this process's totals into the retired snapshot and remove its files; runs at process exit"""
+        if not self.snapshot_dir or self._retired or self._instance_pid != os.getpid():
+            return
+        try:
+            with self._flush_lock, self._dir_lock(exclusive=True):
+                self._retired = True
+                self._fold_into_retired(self.snapshot())
+                for suffix in ('.json', '.alive'):
+                    try:
+                        os.remove(self._path(self._instance, suffix))
+                    except FileNotFoundError:
+                        pass
+            self._alive_file.close()
+        except OSError as e:
+            print(f"⚠️ Could not retire metrics snapshot: {e}")
+
+    def reset_snapshots(self):
+        """
+        Clear snapshots of processes that are gone; call at service start
+        Dead processes' totals are kept (folded into the retired snapshot) while other processes
+        still report, so a restarted web process joining running workers does not reset counters;
+        with no live reporter left they belong to a previous run and are dropped
+        """
+        if not self.snapshot_dir or not os.path.isdir(self.snapshot_dir):
+            return
+        with self._dir_lock(exclusive=True):
+            instances = {
+                filename[len('metrics_'):].split('.')[0] for filename in os.listdir(self.snapshot_dir)
+                if filename.startswith('metrics_') and not filename.startswith(RETIRED_SNAPSHOT)
+            }
+            instances.discard(self._instance)
+            dead = {instance for instance in instances if not _owner_alive(self._path(instance, '.alive'))}
+            keep_totals = len(instances) > len(dead)
+
+            for instance in dead:
+                snapshot = _read_snapshot(self._path(instance))
+                if keep_totals and snapshot is not None:
+                    self._fold_into_retired(snapshot)
+                for suffix in ('.json', '.json.tmp', '.alive'):
+                    try:
+                        os.remove(self._path(instance, suffix))
+                    except FileNotFoundError:
+                        pass
+            if not keep_totals:
+                try:
+                    os.remove(os.path.join(self.snapshot_dir, RETIRED_SNAPSHOT))
+                except FileNotFoundError:
+                    pass
+
+    def _collect(self) -> Tuple[Dict, Dict]:
+        """Sum this process's live values with every other process's latest snapshot and the retired totals"""
+        snapshots = [self.snapshot()]
+        if self.snapshot_dir and os.path.isdir(self.snapshot_dir):
+            own = f"metrics_{self._instance}.json"
+            # Shared lock: a snapshot being folded into the retired totals is never counted twice
+            with self._dir_lock():
+                for filename in os.listdir(self.snapshot_dir):
+                    if not filename.startswith('metrics_') or not filename.endswith('.json') or filename == own:
+                        continue
+                    snapshot = _read_snapshot(os.path.join(self.snapshot_dir, filename))
+                    if snapshot is not None:
+                        snapshots.append(snapshot)
+        return _merge(snapshots)
+
+    def render(self) -> str:
+        """All metrics across processes in Prometheus text exposition format"""
+        counters, histograms = self._collect()
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+
+            for (metric, labels), (bucket_counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(list(buckets) + ['+Inf'], bucket_counts):
+                    cumulative += bucket_count
+                    le = bound if bound == '+Inf' else _format_value(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+# Process-wide registry used by the pipeline modules
+registry = MetricsRegistry()
+
+
+def time_stage(stage: str):
+    """Context manager observing a pipeline stage's duration"""
+    return registry.time('animation_stage_seconds', stage=stage)
+
+
+def observe_stage(stage: str, seconds: float):
+    registry.observe('animation_stage_seconds', seconds, stage=stage)
+
+
+def count_cache(cache: str, hit: bool, count: int = 1):
+    if count:
+        registry.inc('animation_cache_requests_total', count, cache=cache, result='hit' if hit else 'miss')
+
+
+def count_fallback(reason: str):
+    registry.inc('animation_fallbacks_total', reason=reason)
+
+
+def observe_elements(count: int):
+    registry.observe('animation_elements_per_request', count)
+    registry.inc('animation_elements_total', count)
@@ -3,8 +3,42 @@ import cv2
 import numpy as np
 from PIL import Image
 import os
+import threading
+import time
 import urllib.request
-from typing import List, Dict
+from collections import OrderedDict
+from typing import List, Dict, Optional
+from segmentation_cache import SegmentationCache
+from fast_element_splitter import FastElementSplitter
+from element_record import ElementRecord
+from metrics import count_cache, count_fallback, time_stage
+from tracing import annotate, span
+
+# SAM backbones from heaviest/most accurate to lightest/fastest
+SAM_CHECKPOINTS = {
+    'vit_h': 'sam_vit_h_4b8939.pth',
+    'vit_l': 'sam_vit_l_0b3195.pth',
+    'vit_b': 'sam_vit_b_01ec64.pth',
+}
+SAM_CHECKPOINT_URL = "https://dl.fbaipublicfiles.com/segment_anything/{checkpoint}"
+
+# Quality/latency tiers mapped to backbones (None = classical FastElementSplitter, no SAM)
+QUALITY_TIERS = {
+    'fast': None,
+    'interactive': 'vit_b',
+    'balanced': 'vit_l',
+    'high_quality': 'vit_h',
+}
+
+# How SAM is prompted: the automatic point grid, or boxes from a cheap detector
+PROMPT_MODES = ('auto', 'boxes')
+
+# Which levels of a containment hierarchy (house > door, sun > rays) survive de-duplication
+HIERARCHY_MODES = ('parents', 'children', 'all')
+
+# Seconds before a backbone that failed to download or load is tried again (doubles per failure)
+LOAD_RETRY_SECONDS = 30
+LOAD_RETRY_MAX_SECONDS = 30 * 60
 
 class SAMElementSplitter:
     """
@@ -12,90 +46,357 @@ class SAMElementSplitter:
     Provides much more accurate segmentation than traditional methods
     """
     
-    def __init__(self):
+    def __init__(self, cache_dir: Optional[str] = None, cache_max_bytes: int = 512 * 1024 * 1024,
+                 working_resolution: Optional[int] = None, default_model_type: str = "vit_h",
+                 max_loaded_models: int = 2, checkpoint_dir: str = ".", prompt_mode: str = "auto",
+                 hierarchy_mode: str = "parents"):
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self._setup_sam()
+        
+        if default_model_type not in SAM_CHECKPOINTS:
+            raise ValueError(f"Unknown SAM backbone '{default_model_type}', expected one of {list(SAM_CHECKPOINTS)}")
+        
+        # Settings tuned for children's drawings; also part of the segmentation cache key
+        self.default_model_type = default_model_type
+        self.max_elements = 12
+        # Longest side used for preprocessing and mask generation (None = native resolution).
+        # SAM resizes its input to 1024 internally, so larger working images only cost time; the cap
+        # stays opt-in until benchmark_working_resolution.py has measured its mask IoU with real checkpoints.
+        self.working_resolution = working_resolution
+        # 'auto' decodes SAM's point grid; 'boxes' decodes only boxes proposed by the classical engine
+        if prompt_mode not in PROMPT_MODES:
+            raise ValueError(f"Unknown prompt mode '{prompt_mode}', expected one of {PROMPT_MODES}")
+        self.prompt_mode = prompt_mode
+        self.max_box_prompts = 48
+        self.box_prompt_batch_size = 16
+        # Duplicate / nested mask removal before extraction
+        if hierarchy_mode not in HIERARCHY_MODES:
+            raise ValueError(f"Unknown hierarchy mode '{hierarchy_mode}', expected one of {HIERARCHY_MODES}")
+        self.dedup_params = {
+            'bbox_iou_thresh': 0.7,  # Near-identical boxes are the same element
+            'containment_thresh': 0.9,  # Fraction of a mask inside another to count as its part
+            'grid_size': 256,  # Longest side of the downsampled masks used for containment
+            'hierarchy_mode': hierarchy_mode,
+        }
+        self.mask_generator_params = {
+            'points_per_side': 32,
+            'pred_iou_thresh': 0.88,  # Slightly lower for children's drawings
+            'stability_score_thresh': 0.92,  # Slightly lower for children's drawings
+            'crop_n_layers': 1,
+            'crop_n_points_downscale_factor': 2,
+            'min_mask_region_area': 800,  # Filter small regions
+            'box_nms_thresh': 0.7,
+            'crop_nms_thresh': 0.7,
+        }
+        
+        # Backbones are loaded lazily on first use and kept in a bounded LRU pool
+        self.checkpoint_dir = checkpoint_dir
+        self.max_loaded_models = max(1, max_loaded_models)
+        self._mask_generators = OrderedDict()
+        # Backbone -> (monotonic time of the next load attempt, current backoff) after a failed load
+        self._failed_models: Dict[str, tuple] = {}
+        self._sam_installed = None
+        # Guards only the pool bookkeeping; downloads and loads hold a per-backbone lock instead,
+        # so loading vit_h never stalls requests served by an already loaded vit_b
+        self._pool_lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        # SamPredictor keeps the current image embedding between set_image and reset_image,
+        # so each backbone runs one image at a time even when several threads segment
+        self._model_locks: Dict[str, threading.Lock] = {}
+        
+        self.cache = SegmentationCache(cache_dir, cache_max_bytes) if cache_dir else None
+        
+        # Classical engine for the 'fast' tier and for when SAM is unavailable; it keeps its own
+        # working resolution cap unless one is given here
+        fast_kwargs = {'working_resolution': working_resolution} if working_resolution else {}
+        self.fast_splitter = FastElementSplitter(max_elements=self.max_elements, **fast_kwargs)
+    
+    def resolve_model_type(self, tier: Optional[str] = None, model_type: Optional[str] = None) -> Optional[str]:
+        """Pick a backbone from an explicit model type, a quality tier, or the deployment default
+        Returns None for the 'fast' tier, which uses the classical engine instead of SAM"""
+        if model_type:
+            if model_type not in SAM_CHECKPOINTS:
+                raise ValueError(f"Unknown SAM backbone '{model_type}', expected one of {list(SAM_CHECKPOINTS)}")
+            return model_type
+        if tier:
+            if tier not in QUALITY_TIERS:
+                raise ValueError(f"Unknown quality tier '{tier}', expected one of {list(QUALITY_TIERS)}")
+            return QUALITY_TIERS[tier]
+        return self.default_model_type
+    
+    def _get_mask_generator(self, model_type: Optional[str] = None):
+        """Return the mask generator for a backbone, loading it on first use (None if unavailable)"""
+        model_type = model_type or self.default_model_type
+        
+        with self._pool_lock:
+            mask_generator = self._pooled_generator(model_type)
+            if mask_generator is not None or not self._may_load(model_type):
+                return mask_generator
+            load_lock = self._load_locks.setdefault(model_type, threading.Lock())
+        
+        # One thread downloads and loads a backbone; others asking for it wait here, not on the pool
+        with load_lock:
+            with self._pool_lock:
+                mask_generator = self._pooled_generator(model_type)
+                if mask_generator is not None or not self._may_load(model_type):
+                    return mask_generator
+            
+            mask_generator = self._setup_sam(model_type)
+            
+            with self._pool_lock:
+                if mask_generator is None:
+                    if self._sam_installed is not False:
+                        # Downloads fail transiently; back off instead of disabling the backbone for good
+                        _, last_backoff = self._failed_models.get(model_type, (0, 0))
+                        backoff = min(max(last_backoff * 2, LOAD_RETRY_SECONDS), LOAD_RETRY_MAX_SECONDS)
+                        self._failed_models[model_type] = (time.monotonic() + backoff, backoff)
+                        print(f"⚠️ Retrying SAM {model_type} in {backoff:.0f}s")
+                    return None
+                
+                self._failed_models.pop(model_type, None)
+                self._mask_generators[model_type] = mask_generator
+                while len(self._mask_generators) > self.max_loaded_models:
+                    evicted_type, _ = self._mask_generators.popitem(last=False)
+                    print(f"♻️ Unloaded SAM {evicted_type} from model pool")
+                    if self.device == "cuda":
+                        torch.cuda.empty_cache()
+                
+                return mask_generator
+    
+    def _pooled_generator(self, model_type: str):
+        # Caller holds _pool_lock
+        if model_type in self._mask_generators:
+            self._mask_generators.move_to_end(model_type)
+            return self._mask_generators[model_type]
+        return None
+    
+    def _may_load(self, model_type: str) -> bool:
+        # Caller holds _pool_lock
+        if self._sam_installed is False:
+            return False
+        retry_at, _ = self._failed_models.get(model_type, (0, 0))
+        return time.monotonic() >= retry_at
+    
+    def _model_lock(self, model_type: str) -> threading.Lock:
+        with self._pool_lock:
+            return self._model_locks.setdefault(model_type, threading.Lock())
     
-    def _setup_sam(self):
-        """Initialize SAM model"""
+    def _setup_sam(self, model_type: str):
+        """Initialize a SAM backbone and its automatic mask generator"""
         try:
             # Try to import SAM
             from segment_anything import sam_model_registry, SamAutomaticMaskGenerator
+            self._sam_installed = True
             
             # Download SAM checkpoint if not exists
-            checkpoint_path = "sam_vit_h_4b8939.pth"
+            checkpoint_name = SAM_CHECKPOINTS[model_type]
+            checkpoint_path = os.path.join(self.checkpoint_dir, checkpoint_name)
             if not os.path.exists(checkpoint_path):
-                print("📥 Downloading SAM checkpoint (this may take a while)...")
-                urllib.request.urlretrieve(
-                    "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_h_4b8939.pth",
-                    checkpoint_path
-                )
+                print(f"📥 Downloading SAM {model_type} checkpoint (this may take a while)...")
+                os.makedirs(self.checkpoint_dir, exist_ok=True)
+                tmp_path = f"{checkpoint_path}.download"
+                urllib.request.urlretrieve(SAM_CHECKPOINT_URL.format(checkpoint=checkpoint_name), tmp_path)
+                os.replace(tmp_path, checkpoint_path)
                 print("✅ SAM checkpoint downloaded")
             
             # Load SAM model
-            sam = sam_model_registry["vit_h"](checkpoint=checkpoint_path)
+            sam = sam_model_registry[model_type](checkpoint=checkpoint_path)
             sam.to(device=self.device)
             
             # Create automatic mask generator with optimized settings for children's drawings
-            self.mask_generator = SamAutomaticMaskGenerator(
-                model=sam,
-                points_per_side=32,
-                pred_iou_thresh=0.88,  # Slightly lower for children's drawings
-                stability_score_thresh=0.92,  # Slightly lower for children's drawings
-                crop_n_layers=1,
-                crop_n_points_downscale_factor=2,
-                min_mask_region_area=800,  # Filter small regions
-                box_nms_thresh=0.7,
-                crop_nms_thresh=0.7,
-            )
-            print("✅ SAM model loaded successfully")
+            mask_generator = SamAutomaticMaskGenerator(model=sam, **self.mask_generator_params)
+            print(f"✅ SAM {model_type} model loaded successfully")
+            return mask_generator
             
         except ImportError:
             print("⚠️ SAM not installed. Install with: pip install git+https://github.com/facebookresearch/segment-anything.git")
-            self.mask_generator = None
+            self._sam_installed = False
+            return None
         except Exception as e:
-            print(f"⚠️ SAM setup failed: {e}")
-            self.mask_generator = None
+            print(f"⚠️ SAM {model_type} setup failed: {e}")
+            return None
     
-    def split_drawing_elements(self, image_path: str) -> List[Dict]:
+    def split_drawing_elements(self, image_path: str, tier: Optional[str] = None,
+                               model_type: Optional[str] = None, prompt_mode: Optional[str] = None) -> List[ElementRecord]:
         """
         Split drawing using SAM - much more accurate than traditional methods
+        `tier` ('fast', 'interactive', 'balanced', 'high_quality') or `model_type` selects the backbone,
+        `prompt_mode` ('auto' or 'boxes') overrides how SAM is prompted
         """
-        print("🎨 Analyzing drawing with Segment Anything...")
+        prompt_mode = prompt_mode or self.prompt_mode
+        if prompt_mode not in PROMPT_MODES:
+            raise ValueError(f"Unknown prompt mode '{prompt_mode}', expected one of {PROMPT_MODES}")
+        model_type = self.resolve_model_type(tier, model_type)
+        if model_type is None:
+            return self.fast_splitter.split_drawing_elements(image_path)
         
-        if self.mask_generator is None:
-            print("⚠️ SAM not available, falling back to traditional methods")
-            return self._fallback_segmentation(image_path)
+        print(f"🎨 Analyzing drawing with Segment Anything ({model_type})...")
         
         try:
-            # Load image
-            image = cv2.imread(image_path)
-            if image is None:
-                print(f"⚠️ Could not load image: {image_path}")
-                return []
+            # Load image bytes once; they are both the cache key and the decode source
+            with open(image_path, 'rb') as f:
+                image_bytes = f.read()
+            
+            # Cache before the backbone: a hit on a cold worker must not load (or evict) a model it never uses
+            cache_key = None
+            if self.cache is not None:
+                cache_key = self.cache.make_key(image_bytes, self._cache_params(model_type, prompt_mode))
+                cached_elements = self.cache.get(cache_key)
+                count_cache('segmentation', cached_elements is not None)
+                annotate(segmentation_cache_hit=cached_elements is not None)
+                if cached_elements is not None:
+                    print(f"⚡ Segmentation cache hit ({len(cached_elements)} elements)")
+                    return cached_elements
             
-            image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            mask_generator = self._get_mask_generator(model_type)
+            if mask_generator is None:
+                print("⚠️ SAM not available, falling back to traditional methods")
+                count_fallback('sam_unavailable')
+                return self._fallback_segmentation(image_path)
             
-            # Preprocess image for better SAM performance on children's drawings
-            processed_image = self._preprocess_for_sam(image_rgb)
+            with time_stage('image_decode'), span('image_decode', bytes=len(image_bytes)) as args:
+                image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if image is None:
+                    print(f"⚠️ Could not load image: {image_path}")
+                    return []
+                
+                image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+                args.update(width=image_rgb.shape[1], height=image_rgb.shape[0])
+            
+            with time_stage('sam_preprocessing'), span('sam_preprocessing'):
+                # Downscale once; preprocessing and SAM both run at the working resolution
+                working_image, scale = self._resize_to_working_resolution(image_rgb)
+                
+                # Preprocess image for better SAM performance on children's drawings
+                processed_image = self._preprocess_for_sam(working_image)
             
             # Generate masks with SAM
-            print("🔍 Generating masks with SAM...")
-            masks = self.mask_generator.generate(processed_image)
+            with self._model_lock(model_type), time_stage('mask_generation'), \
+                    span('mask_generation', model_type=model_type, prompt_mode=prompt_mode) as args:
+                masks = None
+                if prompt_mode == 'boxes':
+                    print("🔍 Generating masks with SAM from box prompts...")
+                    masks = self._generate_box_prompted_masks(mask_generator.predictor, processed_image, image_rgb, scale)
+                if masks is None:
+                    print("🔍 Generating masks with SAM...")
+                    masks = mask_generator.generate(processed_image)
+                args['masks'] = len(masks)
             
-            # Post-process and filter masks
-            elements = self._process_sam_masks(masks, image_rgb)
+            # Filter and rank masks, then extract only the top elements at full resolution
+            with time_stage('mask_postprocessing'), span('mask_postprocessing', masks=len(masks)):
+                elements = self._process_sam_masks(masks, image_rgb, limit=self.max_elements, scale=scale)
             
-            # Sort by area and quality
-            elements.sort(key=lambda x: x['area'] * x['stability_score'], reverse=True)
+            if cache_key is not None:
+                self.cache.put(cache_key, elements)
             
             print(f"✅ SAM found {len(elements)} high-quality elements")
-            return elements[:12]  # Limit to top 12 elements
+            return elements
             
         except Exception as e:
             print(f"⚠️ SAM segmentation failed: {e}")
+            count_fallback('sam_failed')
             return self._fallback_segmentation(image_path)
     
+    def _generate_box_prompted_masks(self, predictor, processed_image: np.ndarray,
+                                     image_rgb: np.ndarray, scale: float) -> Optional[List[Dict]]:
+        """
+        Encode the image once and run only SAM's mask decoder on detector boxes
+        Returns masks in SamAutomaticMaskGenerator's format, or None when there are no proposals
+        """
+        from segment_anything.utils.amg import batched_mask_to_box, box_xyxy_to_xywh, calculate_stability_score
+        
+        # Proposals come from the original image so the classical engine's area filters apply in original pixels
+        boxes = self.fast_splitter.propose_boxes(image_rgb, self.max_box_prompts)
+        if len(boxes) == 0:
+            print("⚠️ No box proposals found, using automatic point grid")
+            return None
+        
+        # x, y, w, h in original pixels -> x0, y0, x1, y1 at working resolution
+        boxes_xyxy = np.concatenate([boxes[:, :2], boxes[:, :2] + boxes[:, 2:]], axis=1) * scale
+        print(f"📦 Decoding {len(boxes_xyxy)} box prompts")
+        
+        predictor.set_image(processed_image)
+        mask_threshold = predictor.model.mask_threshold
+        
+        masks = []
+        with torch.no_grad():
+            for start in range(0, len(boxes_xyxy), self.box_prompt_batch_size):
+                batch = torch.as_tensor(boxes_xyxy[start:start + self.box_prompt_batch_size],
+                                        dtype=torch.float, device=predictor.device)
+                transformed = predictor.transform.apply_boxes_torch(batch, processed_image.shape[:2])
+                logits, iou_preds, _ = predictor.predict_torch(
+                    point_coords=None, point_labels=None, boxes=transformed,
+                    multimask_output=False, return_logits=True,
+                )
+                logits = logits[:, 0]
+                stability_scores = calculate_stability_score(logits, mask_threshold, 1.0)
+                binary_masks = logits > mask_threshold
+                mask_boxes = box_xyxy_to_xywh(batched_mask_to_box(binary_masks))
+                areas = binary_masks.flatten(1).sum(dim=1)
+                
+                binary_masks = binary_masks.cpu().numpy()
+                for j in range(binary_masks.shape[0]):
+                    masks.append({
+                        'segmentation': binary_masks[j],
+                        'bbox': mask_boxes[j].tolist(),
+                        'area': int(areas[j]),
+                        'predicted_iou': float(iou_preds[j, 0]),
+                        'stability_score': float(stability_scores[j]),
+                    })
+        
+        predictor.reset_image()
+        return masks
+    
+    def _cache_params(self, model_type: str, prompt_mode: str) -> Dict:
+        """Everything besides the image bytes that changes the segmentation output"""
+        return {
+            'model_type': model_type,
+            'prompt_mode': prompt_mode,
+            **self.dedup_params,
+            'max_elements': self.max_elements,
+            'working_resolution': self.working_resolution,
+            **self.mask_generator_params,
+        }
+    
+    def _resize_to_working_resolution(self, image_rgb: np.ndarray):
+        """Downscale so the longest side fits the working resolution; returns (image, scale)"""
+        height, width = image_rgb.shape[:2]
+        longest_side = max(height, width)
+        
+        if not self.working_resolution or longest_side <= self.working_resolution:
+            return image_rgb, 1.0
+        
+        scale = self.working_resolution / longest_side
+        working_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        working_image = cv2.resize(image_rgb, working_size, interpolation=cv2.INTER_AREA)
+        return working_image, scale
+    
+    def _map_to_original(self, mask_data: Dict, scale: float, img_shape):
+        """Map a working-resolution SAM mask to original coordinates; returns (bbox, area)"""
+        if scale == 1.0:
+            return self._ensure_valid_bbox(mask_data['bbox'], img_shape), mask_data['area']
+        
+        bx, by, bw, bh = mask_data['bbox']
+        bbox = self._ensure_valid_bbox(
+            (round(bx / scale), round(by / scale), round(bw / scale), round(bh / scale)), img_shape
+        )
+        return bbox, mask_data['area'] / (scale * scale)
+    
+    def _upsample_mask_crop(self, segmentation: np.ndarray, bbox, scale: float) -> np.ndarray:
+        """Cut the bbox region out of a working-resolution mask and resize it to the original bbox"""
+        x, y, w, h = bbox
+        if scale == 1.0:
+            return segmentation[y:y+h, x:x+w].copy()
+        
+        seg_h, seg_w = segmentation.shape[:2]
+        x0 = min(int(np.floor(x * scale)), seg_w - 1)
+        y0 = min(int(np.floor(y * scale)), seg_h - 1)
+        x1 = max(x0 + 1, min(int(np.ceil((x + w) * scale)), seg_w))
+        y1 = max(y0 + 1, min(int(np.ceil((y + h) * scale)), seg_h))
+        
+        small = segmentation[y0:y1, x0:x1].astype(np.uint8) * 255
+        upsampled = cv2.resize(small, (w, h), interpolation=cv2.INTER_LINEAR)
+        return upsampled > 127
+    
     def _preprocess_for_sam(self, image_rgb: np.ndarray) -> np.ndarray:
         """Preprocess image for better SAM performance on children's drawings"""
         # Enhance contrast for better edge detection
@@ -130,16 +431,17 @@ class SAMElementSplitter:
         
         return x, y, w, h
     
-    def _process_sam_masks(self, masks: List[Dict], original_image: np.ndarray) -> List[Dict]:
-        """Process SAM masks into our element format"""
-        elements = []
+    def _process_sam_masks(self, masks: List[Dict], original_image: np.ndarray,
+                           limit: Optional[int] = None, scale: float = 1.0) -> List[ElementRecord]:
+        """Process SAM masks (generated at `scale` of the original) into compact element records"""
+        image_area = original_image.shape[0] * original_image.shape[1]
         
+        # Filter and rank on SAM metadata alone so no pixels are touched for rejected masks
+        candidates = []
         for i, mask_data in enumerate(masks):
             try:
-                # Extract mask information
-                mask = mask_data['segmentation']
-                bbox = mask_data['bbox']  # [x, y, w, h]
-                area = mask_data['area']
+                # CRITICAL FIX: Ensure valid integer coordinates (in original image space)
+                (x, y, w, h), area = self._map_to_original(mask_data, scale, original_image.shape)
                 stability_score = mask_data['stability_score']
                 predicted_iou = mask_data['predicted_iou']
                 
@@ -150,36 +452,55 @@ class SAMElementSplitter:
                     continue
                 
                 # Size filtering - avoid too large masks (likely background)
-                image_area = original_image.shape[0] * original_image.shape[1]
                 if area > image_area * 0.6:  # Skip if mask covers more than 60% of image
                     continue
                 
-                # CRITICAL FIX: Ensure valid integer coordinates
-                x, y, w, h = self._ensure_valid_bbox(bbox, original_image.shape)
-                
                 # Additional quality checks
                 aspect_ratio = w / h if h > 0 else 1
                 if aspect_ratio > 10 or aspect_ratio < 0.1:  # Skip extremely elongated shapes
                     continue
                 
-                # Extract element image with proper masking
+                # Ensure minimum size
+                if w < 10 or h < 10:
+                    continue
+                
+                candidates.append((i, mask_data, (x, y, w, h), area, aspect_ratio))
+                
+            except Exception as e:
+                print(f"⚠️ Failed to process mask {i}: {e}")
+                continue
+        
+        # Sort by area and quality
+        candidates.sort(key=lambda c: c[3] * c[1]['stability_score'], reverse=True)
+        
+        # Drop duplicates and nested parts before any extraction or classification work
+        candidates, hierarchy = self._deduplicate_candidates(candidates)
+        
+        elements = []
+        for i, mask_data, (x, y, w, h), area, aspect_ratio in candidates:
+            if limit is not None and len(elements) >= limit:
+                break
+            
+            try:
+                # Crop the mask first; only the bbox region is ever copied
+                mask = self._upsample_mask_crop(mask_data['segmentation'], (x, y, w, h), scale)
                 element_img = self._extract_element_image(original_image, mask, [x, y, w, h])
                 
                 if element_img is None:
                     continue
                 
-                elements.append({
-                    'type': f'sam_segment_{i}',
-                    'image': element_img,
-                    'mask': mask[y:y+h, x:x+w],  # Now safe with validated coordinates
-                    'bbox': (x, y, w, h),
-                    'center': (x + w//2, y + h//2),
-                    'area': int(area),
-                    'stability_score': float(stability_score),
-                    'predicted_iou': float(predicted_iou),
-                    'aspect_ratio': float(aspect_ratio),
-                    'sam_data': mask_data
-                })
+                elements.append(ElementRecord(
+                    f'sam_segment_{i}',
+                    image=element_img,
+                    mask=mask,
+                    bbox=(x, y, w, h),
+                    area=area,
+                    stability_score=mask_data['stability_score'],
+                    predicted_iou=mask_data['predicted_iou'],
+                    aspect_ratio=aspect_ratio,
+                    parent=hierarchy[i]['parent'],
+                    children=hierarchy[i]['children'],
+                ))
                 
             except Exception as e:
                 print(f"⚠️ Failed to process mask {i}: {e}")
@@ -187,47 +508,109 @@ class SAMElementSplitter:
         
         return elements
     
+    def _deduplicate_candidates(self, candidates: List):
+        """
+        Vectorized NMS and containment analysis over ranked candidates
+        Returns the surviving candidates (still ranked) and a hierarchy record per mask index
+        """
+        hierarchy = {c[0]: {'parent': None, 'children': []} for c in candidates}
+        if len(candidates) < 2:
+            return candidates, hierarchy
+        
+        params = self.dedup_params
+        count = len(candidates)
+        
+        # Pairwise bbox IoU in original coordinates
+        boxes = np.array([c[2] for c in candidates], dtype=np.float64)
+        x0, y0 = boxes[:, 0], boxes[:, 1]
+        x1, y1 = x0 + boxes[:, 2], y0 + boxes[:, 3]
+        inter_w = np.clip(np.minimum(x1[:, None], x1[None, :]) - np.maximum(x0[:, None], x0[None, :]), 0, None)
+        inter_h = np.clip(np.minimum(y1[:, None], y1[None, :]) - np.maximum(y0[:, None], y0[None, :]), 0, None)
+        box_inter = inter_w * inter_h
+        box_area = boxes[:, 2] * boxes[:, 3]
+        box_iou = box_inter / (box_area[:, None] + box_area[None, :] - box_inter)
+        
+        # Mask containment on a coarse grid: contained[i, j] = fraction of mask i inside mask j
+        seg_h, seg_w = candidates[0][1]['segmentation'].shape[:2]
+        grid_scale = min(1.0, params['grid_size'] / max(seg_h, seg_w))
+        grid_size = (max(1, round(seg_w * grid_scale)), max(1, round(seg_h * grid_scale)))
+        small_masks = np.stack([
+            cv2.resize(c[1]['segmentation'].astype(np.float32), grid_size, interpolation=cv2.INTER_AREA).ravel() >= 0.5
+            for c in candidates
+        ]).astype(np.float32)
+        mask_inter = small_masks @ small_masks.T
+        mask_area = np.diag(mask_inter)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            contained = np.where(mask_area[:, None] > 0, mask_inter / mask_area[:, None], 0.0)
+        np.fill_diagonal(contained, 0.0)
+        
+        # Greedy NMS in rank order: a near-identical box to a better-ranked one is a duplicate
+        duplicate = np.triu(box_iou > params['bbox_iou_thresh'], k=1)
+        suppressed = np.zeros(count, dtype=bool)
+        for i in range(count):
+            if not suppressed[i]:
+                suppressed |= duplicate[i]
+        kept = np.nonzero(~suppressed)[0]
+        
+        # Each kept mask's parent is the smallest larger kept mask that contains it
+        areas = np.array([c[3] for c in candidates], dtype=np.float64)
+        is_container = (contained[np.ix_(kept, kept)] >= params['containment_thresh']) & \
+                       (areas[kept][None, :] > areas[kept][:, None])
+        container_area = np.where(is_container, areas[kept][None, :], np.inf)
+        parent_pos = np.argmin(container_area, axis=1)
+        has_parent = is_container.any(axis=1)
+        
+        for pos, idx in enumerate(kept):
+            if has_parent[pos]:
+                parent_idx = kept[parent_pos[pos]]
+                child_key, parent_key = candidates[idx][0], candidates[parent_idx][0]
+                hierarchy[child_key]['parent'] = f'sam_segment_{parent_key}'
+                hierarchy[parent_key]['children'].append(f'sam_segment_{child_key}')
+        
+        mode = params['hierarchy_mode']
+        if mode == 'parents':
+            kept = kept[~has_parent]
+        elif mode == 'children':
+            kept = [idx for idx in kept if not hierarchy[candidates[idx][0]]['children']]
+        
+        dropped = count - len(kept)
+        if dropped:
+            print(f"🧹 De-duplication removed {dropped} overlapping masks")
+        
+        return [candidates[idx] for idx in kept], hierarchy
+    
     def _extract_element_image(self, original_image: np.ndarray, mask: np.ndarray, bbox: List[int]) -> np.ndarray:
-        """Extract element image with proper background handling"""
+        """Extract element image from a bbox-cropped mask with proper background handling"""
         try:
             x, y, w, h = bbox
             
             # CRITICAL FIX: Ensure all coordinates are integers
             x, y, w, h = int(x), int(y), int(w), int(h)
             
-            # Validate coordinates
-            img_height, img_width = original_image.shape[:2]
-            x = max(0, min(x, img_width - 1))
-            y = max(0, min(y, img_height - 1))
-            w = max(1, min(w, img_width - x))
-            h = max(1, min(h, img_height - y))
+            # Ensure minimum size
+            if h < 10 or w < 10:
+                return None
             
-            # Create element image
-            element_img = original_image.copy()
+            # Copy only the bbox region, never the whole frame
+            cropped = original_image[y:y+h, x:x+w].copy()
+            if cropped.shape[:2] != mask.shape[:2]:
+                print(f"⚠️ Mask shape {mask.shape[:2]} does not match crop {cropped.shape[:2]}")
+                return None
             
             # Apply mask - set non-mask areas to white
-            element_img[~mask] = [255, 255, 255]
-            
-            # Crop to bounding box with integer coordinates
-            cropped = element_img[y:y+h, x:x+w]
+            cropped[~mask] = 255
             
-            # Ensure minimum size
-            if cropped.shape[0] < 10 or cropped.shape[1] < 10:
-                return None
-                
             return cropped
             
         except Exception as e:
             print(f"⚠️ Element extraction failed: {e}")
             return None
     
-    def _fallback_segmentation(self, image_path: str) -> List[Dict]:
+    def _fallback_segmentation(self, image_path: str) -> List[ElementRecord]:
         """Fallback to traditional segmentation methods if SAM fails"""
+        annotate(segmentation_fallback=True)
         try:
-            # Import the traditional ElementSplitter
-            from element_splitter import ElementSplitter
-            traditional_splitter = ElementSplitter()
-            return traditional_splitter.split_drawing_elements(image_path)
+            return self.fast_splitter.split_drawing_elements(image_path)
         except Exception as e:
             print(f"⚠️ Fallback segmentation failed: {e}")
             return []
@@ -0,0 +1,397 @@
+import cv2
+import numpy as np
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Tuple
+from scene_plan import ScenePlan
+
+# Transform quantization: sub-step differences are invisible at sprite sizes we render
+ANGLE_STEP_DEGREES = 0.25
+SCALE_STEP = 0.0025
+
+
+def premultiply_sprite(sprite: np.ndarray) -> np.ndarray:
+    """
+    Float32 (h, w, 4) sprite with color premultiplied by alpha
+    RGB sprites are treated as fully opaque; RGBA alpha is taken from the fourth channel
+    """
+    sprite = np.asarray(sprite)
+    premultiplied = np.empty(sprite.shape[:2] + (4,), dtype=np.float32)
+    if sprite.ndim == 3 and sprite.shape[2] == 4:
+        premultiplied[:, :, 3] = sprite[:, :, 3] / np.float32(255.0)
+        np.multiply(sprite[:, :, :3], premultiplied[:, :, 3:4], out=premultiplied[:, :, :3])
+    else:
+        premultiplied[:, :, :3] = sprite[:, :, :3] if sprite.ndim == 3 else sprite[:, :, None]
+        premultiplied[:, :, 3] = 1.0
+    return premultiplied
+
+
+def transform_sprite(sprite: np.ndarray, angle: float, scale: float) -> np.ndarray:
+    """
+    Rotate (degrees counter-clockwise) and scale a premultiplied sprite about its center
+    The output canvas grows to hold the whole rotated sprite, like MoviePy's rotate(expand=True)
+    """
+    height, width = sprite.shape[:2]
+    radians = np.deg2rad(angle)
+    cos_a, sin_a = abs(np.cos(radians)) * scale, abs(np.sin(radians)) * scale
+    out_width = max(1, int(np.ceil(width * cos_a + height * sin_a)))
+    out_height = max(1, int(np.ceil(width * sin_a + height * cos_a)))
+
+    matrix = cv2.getRotationMatrix2D((width / 2.0, height / 2.0), angle, scale)
+    matrix[0, 2] += out_width / 2.0 - width / 2.0
+    matrix[1, 2] += out_height / 2.0 - height / 2.0
+
+    # Premultiplied color interpolates correctly at the transparent edges
+    return cv2.warpAffine(sprite, matrix, (out_width, out_height), flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0, 0))
+
+
+def blend_layers(sprite: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Split a premultiplied (h, w, 4) sprite into contiguous (h, w, 3) color and 1 - alpha planes
+    Full-width planes keep the per-frame blend on NumPy's fast same-shape loops (no broadcasting)
+    """
+    color = np.ascontiguousarray(sprite[:, :, :3])
+    inv_alpha = np.repeat(1.0 - sprite[:, :, 3:4], 3, axis=2)
+    return color, inv_alpha
+
+
+def render_title_card(text: str, canvas_size: Tuple[int, int], is_intro: bool = True) -> np.ndarray:
+    """Full-canvas RGB title card: vertical gradient with centered, outlined text"""
+    width, height = canvas_size
+    top, bottom = ((70, 110, 200), (150, 90, 190)) if is_intro else ((40, 40, 70), (90, 60, 120))
+
+    ramp = np.linspace(0.0, 1.0, height, dtype=np.float32)[:, None, None]
+    gradient = np.array(top, dtype=np.float32) * (1 - ramp) + np.array(bottom, dtype=np.float32) * ramp
+    card = np.ascontiguousarray(np.broadcast_to(gradient, (height, width, 3)).astype(np.uint8))
+
+    font = cv2.FONT_HERSHEY_DUPLEX
+    font_scale = height / 360.0
+    thickness = max(2, int(round(font_scale * 2)))
+    (text_width, text_height), _ = cv2.getTextSize(text, font, font_scale, thickness)
+    # Shrink long titles to fit the canvas with a margin
+    if text_width > width * 0.9:
+        font_scale *= width * 0.9 / text_width
+        (text_width, text_height), _ = cv2.getTextSize(text, font, font_scale, thickness)
+
+    origin = ((width - text_width) // 2, (height + text_height) // 2)
+    cv2.putText(card, text, origin, font, font_scale, (30, 30, 30), thickness + 4, cv2.LINE_AA)
+    cv2.putText(card, text, origin, font, font_scale, (255, 255, 255), thickness, cv2.LINE_AA)
+    return card
+
+
+class SpriteTransformCache:
+    """
+    LRU cache of rotated/scaled sprites keyed by (track, quantized angle, quantized scale)
+    Entries are blend-ready (color, 1 - alpha) planes; total bytes are bounded per request
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, angle_step: float = ANGLE_STEP_DEGREES,
+                 scale_step: float = SCALE_STEP):
+        self.max_bytes = max_bytes
+        self.angle_step = angle_step
+        self.scale_step = scale_step
+        self._entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def quantize(self, angle: float, scale: float) -> Tuple[int, int]:
+        """Integer transform key in units of the quantization steps"""
+        return int(round(angle / self.angle_step)), int(round(scale / self.scale_step))
+
+    def get(self, row: int, sprite: np.ndarray, angle: float, scale: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Transformed blend planes for a track, computed once per quantized (angle, scale)"""
+        angle_key, scale_key = self.quantize(angle, scale)
+        return self.get_quantized(row, sprite, angle_key, scale_key)
+
+    def get_quantized(self, row: int, sprite: np.ndarray, angle_key: int, scale_key: int) -> Tuple[np.ndarray, np.ndarray]:
+        key = (row, angle_key, scale_key)
+
+        transformed = self._entries.get(key)
+        if transformed is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return transformed
+
+        self.misses += 1
+        # Render at the quantized values so every frame sharing a key looks identical
+        transformed = blend_layers(
+            transform_sprite(sprite, angle_key * self.angle_step, scale_key * self.scale_step)
+        )
+        size = transformed[0].nbytes + transformed[1].nbytes
+        if size > self.max_bytes:
+            return transformed
+
+        self._entries[key] = transformed
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, (color, inv_alpha) = self._entries.popitem(last=False)
+            self.nbytes -= color.nbytes + inv_alpha.nbytes
+        return transformed
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+
+def merge_rects(rects: List[Tuple[int, int, int, int]]) -> List[Tuple[int, int, int, int]]:
+    """Greedily merge (x0, y0, x1, y1) rects whose union is no larger than the two rects combined"""
+    rects = list(rects)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                a, b = rects[i], rects[j]
+                union = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                union_area = (union[2] - union[0]) * (union[3] - union[1])
+                if union_area <= (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]):
+                    rects[i] = union
+                    del rects[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return rects
+
+
+class SceneCompositor:
+    """
+    Renders ScenePlan frames with NumPy, blending each sprite only inside its bounding box
+    Sprites are premultiplied once up front and the frame and blend buffers are reused across frames.
+    Tracks that stay (nearly) still over the rendered frame range and never overlap a moving track
+    beneath them are flattened into a base plate; consecutive frames only recomposite the dirty
+    rectangles of tracks whose drawn state changed.
+    """
+
+    def __init__(self, plan: ScenePlan, transform_cache_bytes: int = 64 * 1024 * 1024,
+                 frame_range: Optional[Tuple[int, int]] = None, static_tolerance_px: float = 1.0):
+        self.plan = plan
+        self.canvas_size = plan.canvas_size
+        width, height = self.canvas_size
+
+        background = np.asarray(plan.background)[:, :, :3]
+        if background.shape[:2] != (height, width):
+            background = cv2.resize(background, (width, height), interpolation=cv2.INTER_AREA)
+        self.background = np.ascontiguousarray(background, dtype=np.uint8)
+
+        self.sprites = [premultiply_sprite(track.sprite) for track in plan.tracks]
+        self.layers = [blend_layers(sprite) for sprite in self.sprites]
+        # Per-request budget: the cache lives and dies with this compositor
+        self.transform_cache = SpriteTransformCache(transform_cache_bytes)
+
+        # Reused for every frame: the output canvas and a float scratch area for one sprite's bbox
+        self._frame = np.empty((height, width, 3), dtype=np.uint8)
+        # (flat so every bbox-sized view of it is contiguous)
+        self._scratch = np.empty(height * width * 3, dtype=np.float32)
+
+        self._compute_draw_states()
+        self.frame_range = frame_range or (0, plan.num_frames)
+        self.static_tolerance_px = static_tolerance_px
+        self._build_base_plate()
+
+        # Incremental rendering state: last frame drawn into self._frame and each track's drawn rect
+        self._last_frame = None
+        self._drawn = [None] * len(plan.tracks)
+
+    def _compute_draw_states(self):
+        """Integer position, quantized transform and opacity each track is drawn with, per frame"""
+        keyframes = self.plan.keyframes
+        cache = self.transform_cache
+        self._xi = np.rint(keyframes['x']).astype(np.int64)
+        self._yi = np.rint(keyframes['y']).astype(np.int64)
+        self._angle_keys = np.rint(keyframes['rotation'] / cache.angle_step).astype(np.int64)
+        self._scale_keys = np.rint(keyframes['scale'] / cache.scale_step).astype(np.int64)
+        self._identity_scale_key = int(round(1.0 / cache.scale_step))
+        self._opacity = keyframes['opacity']
+        self._shown = self.plan.visible & (self._opacity > 0.0)
+
+        # changed[row, f]: the track is drawn differently on frame f than on frame f - 1
+        num_tracks, num_frames = self._shown.shape
+        self._changed = np.ones((num_tracks, num_frames), dtype=bool)
+        if num_frames > 1:
+            self._changed[:, 1:] = (
+                (self._shown[:, 1:] != self._shown[:, :-1]) |
+                (self._xi[:, 1:] != self._xi[:, :-1]) | (self._yi[:, 1:] != self._yi[:, :-1]) |
+                (self._angle_keys[:, 1:] != self._angle_keys[:, :-1]) |
+                (self._scale_keys[:, 1:] != self._scale_keys[:, :-1]) |
+                (self._opacity[:, 1:] != self._opacity[:, :-1])
+            )
+
+    def _is_static(self, row: int, start: int, stop: int) -> bool:
+        """True if the track never moves more than static_tolerance_px from its pose on frame `start`"""
+        shown = self._shown[row, start:stop]
+        if not shown.any():
+            return True
+        if not shown.all():
+            return False
+
+        keyframes = self.plan.keyframes
+        x, y = keyframes['x'][row, start:stop], keyframes['y'][row, start:stop]
+        scale = keyframes['scale'][row, start:stop]
+        rotation = np.deg2rad(keyframes['rotation'][row, start:stop])
+        opacity = self._opacity[row, start:stop]
+
+        # Worst-case pixel displacement of the sprite's corners relative to the frozen pose
+        height, width = self.sprites[row].shape[:2]
+        half_diagonal = 0.5 * np.hypot(width, height) * float(scale.max())
+        displacement = (
+            np.hypot(x - x[0], y - y[0]) +
+            (np.abs(scale - scale[0]) + np.abs(rotation - rotation[0])) * half_diagonal
+        )
+        # A half-level opacity change is invisible after rounding to uint8
+        return float(displacement.max()) <= self.static_tolerance_px and float(np.ptp(opacity)) * 255 < 0.5
+
+    def _swept_rect(self, row: int, start: int, stop: int) -> Optional[Tuple[int, int, int, int]]:
+        """Conservative (x0, y0, x1, y1) covering everything a track draws over frames [start, stop)"""
+        shown = self._shown[row, start:stop]
+        if not shown.any():
+            return None
+        xs, ys = self._xi[row, start:stop][shown], self._yi[row, start:stop][shown]
+        height, width = self.sprites[row].shape[:2]
+        angle_keys, scale_keys = self._angle_keys[row, start:stop][shown], self._scale_keys[row, start:stop][shown]
+        if angle_keys.any() or (scale_keys != self._identity_scale_key).any():
+            # A rotated, scaled sprite fits in a square of its scaled diagonal
+            scale = float(scale_keys.max()) * self.transform_cache.scale_step
+            width = height = int(np.ceil(np.hypot(width, height) * scale)) + 1
+        return int(xs.min()), int(ys.min()), int(xs.max()) + width, int(ys.max()) + height
+
+    def _build_base_plate(self):
+        """
+        Background plus the static tracks, frozen at the range's first frame
+        A static track is only flattened if no moving track beneath it ever reaches its area:
+        moving tracks above it are drawn over the plate anyway, so the stacking order is kept
+        """
+        start, stop = self.frame_range
+        self.base_plate = self.background.copy()
+        self.static_rows = []
+        self.dynamic_rows = []
+        if start >= stop:
+            self.dynamic_rows = list(range(len(self.plan.tracks)))
+            return
+
+        moving_rects = []
+        for row in range(len(self.plan.tracks)):
+            rect = self._swept_rect(row, start, stop)
+            covered = rect is not None and any(
+                rect[0] < other[2] and other[0] < rect[2] and rect[1] < other[3] and other[1] < rect[3]
+                for other in moving_rects
+            )
+            if not covered and self._is_static(row, start, stop):
+                self.static_rows.append(row)
+                if self._shown[row, start]:
+                    self._draw_track(self.base_plate, row, start)
+            else:
+                self.dynamic_rows.append(row)
+                if rect is not None:
+                    moving_rects.append(rect)
+
+    def render_frame(self, frame: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Composite one frame of the plan
+        Returns the compositor's internal buffer (overwritten by the next call) unless `out` is given
+        """
+        if out is not None:
+            self._render_full(out, frame, remember=False)
+            return out
+
+        start, stop = self.frame_range
+        if self._last_frame is not None and frame == self._last_frame + 1 and start < frame < stop:
+            self._render_dirty(frame)
+        else:
+            self._render_full(self._frame, frame, remember=True)
+        self._last_frame = frame
+        return self._frame
+
+    def iter_frames(self, start: int = 0, stop: Optional[int] = None) -> Iterator[np.ndarray]:
+        """Yield frames in order; each yielded array is the reused internal buffer"""
+        stop = self.plan.num_frames if stop is None else min(stop, self.plan.num_frames)
+        for frame in range(start, stop):
+            yield self.render_frame(frame)
+
+    def _render_full(self, canvas: np.ndarray, frame: int, remember: bool):
+        """Redraw everything: the base plate (only valid inside frame_range) plus the other tracks"""
+        start, stop = self.frame_range
+        in_range = start <= frame < stop
+        np.copyto(canvas, self.base_plate if in_range else self.background)
+
+        for row in (self.dynamic_rows if in_range else range(len(self.plan.tracks))):
+            rect = self._draw_track(canvas, row, frame) if self._shown[row, frame] else None
+            if remember:
+                self._drawn[row] = rect
+
+    def _render_dirty(self, frame: int):
+        """Recomposite only the areas covered by changed tracks on this frame and the previous one"""
+        dirty = []
+        for row in self.dynamic_rows:
+            if not self._changed[row, frame]:
+                continue
+            if self._drawn[row] is not None:
+                dirty.append(self._drawn[row])
+            rect = self._track_rect(row, frame) if self._shown[row, frame] else None
+            if rect is not None:
+                dirty.append(rect)
+            self._drawn[row] = rect
+
+        for clip in merge_rects(dirty):
+            x0, y0, x1, y1 = clip
+            np.copyto(self._frame[y0:y1, x0:x1], self.base_plate[y0:y1, x0:x1])
+            for row in self.dynamic_rows:
+                drawn = self._drawn[row]
+                if drawn is not None and drawn[0] < x1 and x0 < drawn[2] and drawn[1] < y1 and y0 < drawn[3]:
+                    self._draw_track(self._frame, row, frame, clip)
+
+    def _layers_for(self, row: int, frame: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Blend planes for a track with that frame's quantized rotation and scale applied"""
+        angle_key = int(self._angle_keys[row, frame])
+        scale_key = int(self._scale_keys[row, frame])
+
+        if angle_key == 0 and scale_key == self._identity_scale_key:
+            return self.layers[row]
+        return self.transform_cache.get_quantized(row, self.sprites[row], angle_key, scale_key)
+
+    def _track_rect(self, row: int, frame: int) -> Optional[Tuple[int, int, int, int]]:
+        """Canvas-clipped (x0, y0, x1, y1) a track covers on a frame, or None if off-canvas"""
+        height, width = self._layers_for(row, frame)[0].shape[:2]
+        x, y = int(self._xi[row, frame]), int(self._yi[row, frame])
+        canvas_width, canvas_height = self.canvas_size
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, canvas_width), min(y + height, canvas_height)
+        return (x0, y0, x1, y1) if x0 < x1 and y0 < y1 else None
+
+    def _draw_track(self, canvas: np.ndarray, row: int, frame: int,
+                    clip: Optional[Tuple[int, int, int, int]] = None) -> Optional[Tuple[int, int, int, int]]:
+        """Blend one track as drawn on `frame`; returns the canvas rect it covers"""
+        layers = self._layers_for(row, frame)
+        x, y = int(self._xi[row, frame]), int(self._yi[row, frame])
+        self._blend(canvas, layers, x, y, float(self._opacity[row, frame]), clip)
+        return self._track_rect(row, frame)
+
+    def _blend(self, canvas: np.ndarray, layers: Tuple[np.ndarray, np.ndarray], x: int, y: int, opacity: float,
+               clip: Optional[Tuple[int, int, int, int]] = None):
+        """Premultiplied 'over' blend of a sprite with its top-left corner at (x, y), limited to `clip`"""
+        color, inv_alpha = layers
+        sprite_height, sprite_width = color.shape[:2]
+        clip_x0, clip_y0, clip_x1, clip_y1 = clip or (0, 0, canvas.shape[1], canvas.shape[0])
+
+        # Clip the sprite bbox to the canvas (or dirty rect)
+        x0, y0 = max(x, clip_x0), max(y, clip_y0)
+        x1, y1 = min(x + sprite_width, clip_x1), min(y + sprite_height, clip_y1)
+        if x0 >= x1 or y0 >= y1:
+            return
+
+        color = color[y0 - y:y1 - y, x0 - x:x1 - x]
+        inv_alpha = inv_alpha[y0 - y:y1 - y, x0 - x:x1 - x]
+        region = canvas[y0:y1, x0:x1]
+        scratch = self._scratch[:color.size].reshape(color.shape)
+
+        # out = dst * (1 - a * opacity) + premultiplied_src * opacity
+        np.copyto(scratch, region, casting='unsafe')
+        if opacity >= 1.0:
+            scratch *= inv_alpha
+            scratch += color
+        else:
+            scratch *= 1.0 - opacity + inv_alpha * opacity
+            scratch += color * opacity
+        scratch += 0.5
+        np.copyto(region, scratch, casting='unsafe')
@@ -0,0 +1,143 @@
+import json
+import os
+import cv2
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from scene_plan import CHANNELS, ScenePlan
+
+# Bump when the exported plan layout changes
+PLAN_FORMAT_VERSION = 1
+
+ATLAS_FORMATS = ('png', 'webp')
+
+
+def pack_atlas(sprites: List[np.ndarray], padding: int = 2) -> Tuple[np.ndarray, List[Tuple[int, int, int, int]]]:
+    """
+    Shelf-pack sprites into one RGBA atlas
+    Returns the atlas and each sprite's (x, y, w, h) rect, in input order
+    """
+    if not sprites:
+        return np.zeros((1, 1, 4), dtype=np.uint8), []
+
+    sizes = [(sprite.shape[1] + padding, sprite.shape[0] + padding) for sprite in sprites]
+    total_area = sum(w * h for w, h in sizes)
+    # Aim for a roughly square atlas, never narrower than the widest sprite
+    atlas_width = max(max(w for w, _ in sizes), int(np.ceil(np.sqrt(total_area))))
+
+    rects = [None] * len(sprites)
+    shelf_x = shelf_y = shelf_height = 0
+    # Tallest first keeps shelves tightly filled
+    for i in sorted(range(len(sprites)), key=lambda i: -sizes[i][1]):
+        w, h = sizes[i]
+        if shelf_x + w > atlas_width:
+            shelf_y += shelf_height
+            shelf_x = shelf_height = 0
+        rects[i] = (shelf_x, shelf_y, w - padding, h - padding)
+        shelf_x += w
+        shelf_height = max(shelf_height, h)
+
+    atlas = np.zeros((shelf_y + shelf_height, atlas_width, 4), dtype=np.uint8)
+    for sprite, (x, y, w, h) in zip(sprites, rects):
+        atlas[y:y+h, x:x+w] = to_rgba(sprite)
+    return atlas, rects
+
+
+def to_rgba(sprite: np.ndarray) -> np.ndarray:
+    """RGBA copy of a sprite; RGB sprites become fully opaque"""
+    if sprite.ndim == 3 and sprite.shape[2] == 4:
+        return sprite
+    rgb = sprite if sprite.ndim == 3 else np.repeat(sprite[:, :, None], 3, axis=2)
+    alpha = np.full(rgb.shape[:2] + (1,), 255, dtype=np.uint8)
+    return np.concatenate([rgb[:, :, :3], alpha], axis=2)
+
+
+def _channel_samples(values: np.ndarray, decimals: int):
+    """Constant channels collapse to a single number; others become a rounded list"""
+    rounded = np.round(values.astype(np.float64), decimals)
+    if np.all(rounded == rounded[0]):
+        return float(rounded[0])
+    return rounded.tolist()
+
+
+def _jsonable(value):
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+
+def build_plan_document(plan: ScenePlan, rects: List[Tuple[int, int, int, int]], atlas_file: str,
+                        background_file: str, sample_fps: Optional[float] = None) -> Dict:
+    """Renderer-independent scene description for client-side playback"""
+    sample_fps = sample_fps or plan.fps
+    sample_count = max(1, int(round(plan.duration * sample_fps)))
+    source = np.minimum(np.rint(np.arange(sample_count) / sample_fps * plan.fps).astype(np.int64),
+                        plan.num_frames - 1)
+
+    tracks = []
+    for row, (track, rect) in enumerate(zip(plan.tracks, rects)):
+        visible = plan.visible[row, source]
+        first_visible = int(np.argmax(visible)) if visible.any() else None
+        tracks.append({
+            'label': track.label,
+            'layer': track.layer,
+            'atlas_rect': list(rect),
+            'bbox': list(track.bbox),
+            'behavior': track.behavior.describe(),
+            # Sampled keyframes: x/y is the top-left of the transformed sprite, rotation in degrees CCW
+            'visible_from': first_visible,
+            'keyframes': {
+                channel: _channel_samples(plan.keyframes[channel][row, source], 3 if channel == 'scale' else 2)
+                for channel in CHANNELS
+            },
+        })
+
+    return {
+        'version': PLAN_FORMAT_VERSION,
+        'canvas_size': list(plan.canvas_size),
+        'duration': plan.duration,
+        'sample_fps': sample_fps,
+        'num_samples': sample_count,
+        'background': background_file,
+        'atlas': atlas_file,
+        'tracks': tracks,
+        'metadata': plan.metadata,
+    }
+
+
+def export_scene(plan: ScenePlan, output_dir: str, name: str, atlas_format: str = 'webp',
+                 sample_fps: Optional[float] = None) -> Dict[str, str]:
+    """
+    Write <name>.json (scene plan), <name>_atlas.<format> (sprites with alpha) and
+    <name>_background.jpg; returns the written paths by kind
+    """
+    if atlas_format not in ATLAS_FORMATS:
+        raise ValueError(f"Unknown atlas format '{atlas_format}', expected one of {ATLAS_FORMATS}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    atlas, rects = pack_atlas([track.sprite for track in plan.tracks])
+    atlas_file = f"{name}_atlas.{atlas_format}"
+    background_file = f"{name}_background.jpg"
+    plan_file = f"{name}.json"
+
+    paths = {
+        'atlas': os.path.join(output_dir, atlas_file),
+        'background': os.path.join(output_dir, background_file),
+        'plan': os.path.join(output_dir, plan_file),
+    }
+
+    params = [cv2.IMWRITE_WEBP_QUALITY, 101] if atlas_format == 'webp' else [cv2.IMWRITE_PNG_COMPRESSION, 6]
+    if not cv2.imwrite(paths['atlas'], cv2.cvtColor(atlas, cv2.COLOR_RGBA2BGRA), params):
+        raise RuntimeError(f"Could not write sprite atlas to {paths['atlas']}")
+    background = cv2.cvtColor(np.asarray(plan.background)[:, :, :3], cv2.COLOR_RGB2BGR)
+    if not cv2.imwrite(paths['background'], background, [cv2.IMWRITE_JPEG_QUALITY, 90]):
+        raise RuntimeError(f"Could not write background to {paths['background']}")
+
+    document = build_plan_document(plan, rects, atlas_file, background_file, sample_fps)
+    # Plan last, atomically: once it exists, everything it references does too
+    tmp_path = f"{paths['plan']}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(document, f, separators=(',', ':'), default=_jsonable)
+    os.replace(tmp_path, paths['plan'])
+
+    print(f"📦 Exported scene plan with {len(plan.tracks)} sprites ({atlas.shape[1]}x{atlas.shape[0]} atlas)")
+    return paths
@@ -0,0 +1,252 @@
+import cv2
+import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Per-frame channels stored in a ScenePlan keyframe table
+CHANNELS = ('x', 'y', 'scale', 'rotation', 'opacity')
+
+# Largest per-channel difference still treated as the same pose when detecting loops
+LOOP_TOLERANCES = {'x': 0.5, 'y': 0.5, 'scale': 0.0025, 'rotation': 0.25, 'opacity': 1.0 / 255}
+# Poses must match exactly, so repeated frames are identical to the ones they replace
+EXACT_LOOP_TOLERANCES = dict.fromkeys(LOOP_TOLERANCES, 0.0)
+
+
+def resize_sprite(sprite: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """
+    Area-resize an image to (width, height); RGBA is filtered premultiplied and converted back
+    to straight alpha, so color under transparent pixels never bleeds into the edges
+    """
+    if sprite.ndim != 3 or sprite.shape[2] != 4:
+        return cv2.resize(sprite, size, interpolation=cv2.INTER_AREA)
+
+    premultiplied = sprite.astype(np.float32)
+    premultiplied[:, :, :3] *= premultiplied[:, :, 3:4] / np.float32(255.0)
+    resized = cv2.resize(premultiplied, size, interpolation=cv2.INTER_AREA).reshape(size[1], size[0], 4)
+
+    alpha = resized[:, :, 3:4]
+    color = np.zeros_like(resized[:, :, :3])
+    np.divide(resized[:, :, :3] * np.float32(255.0), alpha, out=color, where=alpha > 0)
+    result = np.empty(resized.shape, dtype=np.uint8)
+    np.clip(np.rint(color), 0, 255, out=color)
+    result[:, :, :3] = color
+    result[:, :, 3] = np.clip(np.rint(resized[:, :, 3]), 0, 255)
+    return result
+
+
+def transformed_offset(offset: Tuple[int, int], sprite_size: Tuple[int, int], element_size: Tuple[int, int],
+                       scale, rotation) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Where a trimmed sprite's expanded transform box sits relative to the whole element's, per frame
+    Behaviors place the element rotated (degrees counter-clockwise) and scaled about its center;
+    the sprite's center moves with that transform and its own, smaller box is expanded around it
+    """
+    width, height = element_size
+    sprite_width, sprite_height = sprite_size
+    radians = np.deg2rad(rotation)
+    cos_a, sin_a = np.cos(radians) * scale, np.sin(radians) * scale
+    abs_cos, abs_sin = np.abs(cos_a), np.abs(sin_a)
+
+    # Sprite center relative to the element center, before and after the transform (image y points down)
+    center_x = offset[0] + sprite_width / 2.0 - width / 2.0
+    center_y = offset[1] + sprite_height / 2.0 - height / 2.0
+    moved_x = cos_a * center_x + sin_a * center_y
+    moved_y = cos_a * center_y - sin_a * center_x
+
+    # Half the growth of each expanded box, as in transform_sprite and MoviePy's rotate(expand=True)
+    element_half_width = (width * abs_cos + height * abs_sin) / 2.0
+    element_half_height = (width * abs_sin + height * abs_cos) / 2.0
+    sprite_half_width = (sprite_width * abs_cos + sprite_height * abs_sin) / 2.0
+    sprite_half_height = (sprite_width * abs_sin + sprite_height * abs_cos) / 2.0
+    return (element_half_width + moved_x - sprite_half_width,
+            element_half_height + moved_y - sprite_half_height)
+
+
+class Behavior:
+    """
+    Vectorized animation behavior for one element
+    Each channel function takes local time t (scalar or NumPy array, seconds since `start`)
+    and returns values of the same shape; missing channels are constant
+    """
+
+    __slots__ = ('name', 'start', 'params', 'position', 'scale', 'rotation', 'opacity')
+
+    def __init__(self, name: str, position: Callable, start: float = 0.0, params: Optional[Dict] = None,
+                 scale: Optional[Callable] = None, rotation: Optional[Callable] = None,
+                 opacity: Optional[Callable] = None):
+        self.name = name
+        self.start = float(start)
+        self.params = params or {}
+        self.position = position
+        self.scale = scale
+        self.rotation = rotation
+        self.opacity = opacity
+
+    def evaluate(self, t) -> Dict[str, np.ndarray]:
+        """Evaluate every channel for all times in t at once"""
+        t = np.asarray(t, dtype=np.float64)
+        x, y = self.position(t)
+        scale = self.scale(t) if self.scale is not None else 1.0
+        rotation = self.rotation(t) if self.rotation is not None else 0.0
+        opacity = self.opacity(t) if self.opacity is not None else 1.0
+
+        return {
+            channel: np.broadcast_to(np.asarray(values, dtype=np.float64), t.shape)
+            for channel, values in zip(CHANNELS, (x, y, scale, rotation, opacity))
+        }
+
+    def __getstate__(self):
+        # Channel functions are closures; a pickled behavior keeps only its description
+        return {'name': self.name, 'start': self.start, 'params': self.params}
+
+    def __setstate__(self, state):
+        self.__init__(state['name'], None, state['start'], state['params'])
+
+    def describe(self) -> Dict:
+        """Renderer-independent description: behavior name, start offset and parameters"""
+        return {'behavior': self.name, 'start': self.start, 'params': dict(self.params)}
+
+
+class ElementTrack:
+    """
+    One animated sprite in a scene plan, with the behavior that produced its keyframes
+    The sprite is RGB or straight-alpha RGBA; offset is where its top-left sits relative to the
+    element's bbox corner (non-zero when the sprite was trimmed to its alpha bounds), before the
+    behavior's rotation and scale
+    """
+
+    __slots__ = ('index', 'label', 'layer', 'sprite', 'bbox', 'behavior', 'offset')
+
+    def __init__(self, index: int, label: str, layer: str, sprite: np.ndarray,
+                 bbox: Tuple[int, int, int, int], behavior: Behavior, offset: Tuple[int, int] = (0, 0)):
+        self.index = index
+        self.label = label
+        self.layer = layer
+        self.sprite = sprite
+        self.bbox = bbox
+        self.behavior = behavior
+        self.offset = offset
+
+
+class ScenePlan:
+    """
+    A whole scene compiled to a per-frame keyframe table
+    keyframes[channel] is a (num_tracks, num_frames) float array; x/y is the top-left corner of
+    the transformed sprite on the canvas, rotation is in degrees counter-clockwise, and a track
+    is only drawn on frames where visible[track, frame] is True. Tracks are ordered back to front.
+    Plans pickle with their keyframe table so render worker processes can draw them.
+    """
+
+    def __init__(self, canvas_size: Tuple[int, int], fps: float, duration: float,
+                 background: np.ndarray, tracks: List[ElementTrack], metadata: Optional[Dict] = None):
+        self.canvas_size = canvas_size
+        self.fps = fps
+        self.duration = duration
+        self.background = background
+        self.tracks = tracks
+        self.metadata = metadata or {}
+
+        self.num_frames = int(round(duration * fps))
+        self.frame_times = np.arange(self.num_frames, dtype=np.float64) / fps
+
+        num_tracks = len(tracks)
+        self.keyframes = {
+            channel: np.zeros((num_tracks, self.num_frames), dtype=np.float32) for channel in CHANNELS
+        }
+        self.visible = np.zeros((num_tracks, self.num_frames), dtype=bool)
+
+        for row, track in enumerate(tracks):
+            local_t = self.frame_times - track.behavior.start
+            values = track.behavior.evaluate(np.maximum(local_t, 0.0))
+            for channel in CHANNELS:
+                self.keyframes[channel][row] = values[channel]
+            if tuple(track.offset) != (0, 0):
+                # Behaviors place the untrimmed element; shift to the trimmed sprite's box on every frame
+                height, width = track.sprite.shape[:2]
+                dx, dy = transformed_offset(track.offset, (width, height), track.bbox[2:],
+                                            values['scale'], values['rotation'])
+                self.keyframes['x'][row] += dx
+                self.keyframes['y'][row] += dy
+            # Twinkle and fade curves may overshoot; opacity is a blend weight
+            np.clip(self.keyframes['opacity'][row], 0.0, 1.0, out=self.keyframes['opacity'][row])
+            self.visible[row] = local_t >= 0
+
+    def frame_index(self, t: float) -> int:
+        """Nearest frame index for a scene time in seconds"""
+        return int(min(max(round(t * self.fps), 0), self.num_frames - 1))
+
+    def track_state(self, row: int, frame: int) -> Dict[str, float]:
+        """All channel values for one track on one frame"""
+        return {channel: float(self.keyframes[channel][row, frame]) for channel in CHANNELS}
+
+    def detect_loop(self, min_period_seconds: float = 0.5,
+                    tolerances: Optional[Dict[str, float]] = None) -> Optional[Tuple[int, int]]:
+        """
+        Find a steady state that repeats: (start_frame, period_frames) such that every frame from
+        start_frame + period_frames on matches the frame one period earlier, or None.
+        Only loops that repeat at least twice are reported; the one needing the fewest
+        rendered frames (start + period) wins.
+        """
+        tolerances = tolerances or LOOP_TOLERANCES
+        num_frames = self.num_frames
+        if not self.tracks or num_frames < 2:
+            return None
+
+        best = None
+        min_period = max(1, int(round(min_period_seconds * self.fps)))
+        for period in range(min_period, num_frames // 2 + 1):
+            # mismatch[f - period]: frame f differs from frame f - period
+            mismatch = np.any(self.visible[:, period:] != self.visible[:, :-period], axis=0)
+            for channel in CHANNELS:
+                values = self.keyframes[channel]
+                mismatch |= np.any(np.abs(values[:, period:] - values[:, :-period]) > tolerances[channel], axis=0)
+
+            mismatched = np.nonzero(mismatch)[0]
+            # Earliest frame from which the scene repeats with this period
+            start = int(mismatched[-1]) + 1 if len(mismatched) else 0
+            if start + 2 * period > num_frames:
+                continue
+            if best is None or start + period < best[0] + best[1]:
+                best = (start, period)
+
+        return best
+
+    def resampled(self, canvas_size: Tuple[int, int], fps: float) -> 'ScenePlan':
+        """
+        The same scene at another canvas size and frame rate (e.g. a low-resolution preview)
+        Derived from the keyframe table and sprites, without re-evaluating behaviors
+        """
+        scale_x = canvas_size[0] / self.canvas_size[0]
+        scale_y = canvas_size[1] / self.canvas_size[1]
+
+        def resize(image, width, height):
+            return resize_sprite(image, (max(1, int(round(width))), max(1, int(round(height)))))
+
+        tracks = []
+        for track in self.tracks:
+            height, width = track.sprite.shape[:2]
+            x, y, w, h = track.bbox
+            tracks.append(ElementTrack(
+                track.index, track.label, track.layer,
+                resize(track.sprite, width * scale_x, height * scale_y),
+                (int(round(x * scale_x)), int(round(y * scale_y)), int(round(w * scale_x)), int(round(h * scale_y))),
+                track.behavior,
+                (int(round(track.offset[0] * scale_x)), int(round(track.offset[1] * scale_y))),
+            ))
+
+        plan = ScenePlan.__new__(ScenePlan)
+        plan.canvas_size = tuple(canvas_size)
+        plan.fps = fps
+        plan.duration = self.duration
+        plan.background = resize(self.background, canvas_size[0], canvas_size[1])
+        plan.tracks = tracks
+        plan.metadata = dict(self.metadata)
+        plan.num_frames = int(round(self.duration * fps))
+        plan.frame_times = np.arange(plan.num_frames, dtype=np.float64) / fps
+
+        # Nearest source frame for every output frame
+        source = np.minimum(np.rint(plan.frame_times * self.fps).astype(np.int64), self.num_frames - 1)
+        plan.keyframes = {channel: self.keyframes[channel][:, source] for channel in CHANNELS}
+        plan.keyframes['x'] *= scale_x
+        plan.keyframes['y'] *= scale_y
+        plan.visible = self.visible[:, source]
+        return plan
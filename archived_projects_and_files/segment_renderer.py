@@ -0,0 +1,276 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+from metrics import count_cache, observe_stage, registry, time_stage
+from scene_compositor import SceneCompositor, render_title_card
+from scene_plan import EXACT_LOOP_TOLERANCES, ScenePlan
+from title_card_cache import TitleCardCache
+from tracing import Trace, current_trace, span, use_trace
+from video_encoder import FFmpegPipeEncoder, concat_segments
+
+# Frames per traced render batch
+FRAME_BATCH = 24
+
+
+class Timeline:
+    """Full video timeline: optional intro title card, the composited scene, optional outro title card"""
+
+    def __init__(self, plan: ScenePlan, intro_text: Optional[str] = None, outro_text: Optional[str] = None,
+                 title_seconds: float = 2, transform_cache_bytes: int = 64 * 1024 * 1024):
+        self.plan = plan
+        self.fps = plan.fps
+        self.canvas_size = plan.canvas_size
+        self.intro_text = intro_text
+        self.outro_text = outro_text
+        self.title_seconds = title_seconds
+        self.transform_cache_bytes = transform_cache_bytes
+
+        title_frames = int(round(title_seconds * plan.fps))
+        self.intro_frames = title_frames if intro_text else 0
+        self.outro_frames = title_frames if outro_text else 0
+        self.num_frames = self.intro_frames + plan.num_frames + self.outro_frames
+
+        # Built lazily so the timeline pickles cheaply into render workers
+        self._compositor = None
+        self._intro = None
+        self._outro = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_compositor=None, _intro=None, _outro=None)
+        return state
+
+    def prepare(self, start: int, stop: int):
+        """Build the compositor for timeline frames [start, stop) so static layers are detected over that range"""
+        scene_start = max(start - self.intro_frames, 0)
+        scene_stop = min(stop - self.intro_frames, self.plan.num_frames)
+        if scene_start < scene_stop:
+            self._compositor = SceneCompositor(self.plan, self.transform_cache_bytes,
+                                               frame_range=(scene_start, scene_stop))
+
+    def frame(self, index: int) -> np.ndarray:
+        """RGB frame for a timeline frame index (may be a reused buffer)"""
+        if index < self.intro_frames:
+            if self._intro is None:
+                self._intro = render_title_card(self.intro_text, self.canvas_size, is_intro=True)
+            return self._intro
+
+        scene_index = index - self.intro_frames
+        if scene_index >= self.plan.num_frames:
+            if self._outro is None:
+                self._outro = render_title_card(self.outro_text, self.canvas_size, is_intro=False)
+            return self._outro
+
+        if self._compositor is None:
+            self._compositor = SceneCompositor(self.plan, self.transform_cache_bytes)
+        return self._compositor.render_frame(scene_index)
+
+
+def plan_segments(num_frames: int, gop_size: int, max_segments: int) -> List[Tuple[int, int]]:
+    """
+    Split [0, num_frames) into at most max_segments contiguous ranges
+    Every boundary falls on a multiple of gop_size, i.e. on a keyframe of the joined video
+    """
+    num_gops = max(1, -(-num_frames // gop_size))
+    num_segments = max(1, min(max_segments, num_gops))
+
+    # Spread whole GOPs as evenly as possible across segments
+    boundaries = [round(i * num_gops / num_segments) * gop_size for i in range(num_segments + 1)]
+    boundaries[-1] = num_frames
+    return [(start, stop) for start, stop in zip(boundaries, boundaries[1:]) if start < stop]
+
+
+def _render_segment(timeline: Timeline, start: int, stop: int, segment_path: str, encoder_kwargs: dict,
+                    trace: bool = False) -> Tuple[str, List[dict]]:
+    """
+    Worker: composite and encode one range of timeline frames
+    Returns the segment path and, with trace set (in a worker process), the spans recorded there;
+    in-process calls record straight into the current trace
+    """
+    segment_trace = Trace('render_segment') if trace else current_trace()
+    with use_trace(segment_trace), span('render_segment', first=start, last=stop - 1):
+        segment_start = time.perf_counter()
+        timeline.prepare(start, stop)
+        compositing = 0.0
+        with FFmpegPipeEncoder(segment_path, timeline.canvas_size, timeline.fps, **encoder_kwargs) as encoder:
+            for batch_start in range(start, stop, FRAME_BATCH):
+                batch_stop = min(batch_start + FRAME_BATCH, stop)
+                with span('frames', first=batch_start, last=batch_stop - 1):
+                    for index in range(batch_start, batch_stop):
+                        frame_start = time.perf_counter()
+                        frame = timeline.frame(index)
+                        compositing += time.perf_counter() - frame_start
+                        encoder.write_frame(frame)
+        # The time after the last batch inside the segment span is ffmpeg finishing the segment
+
+    # Everything besides compositing is spent handing frames to ffmpeg or waiting for it to finish
+    observe_stage('compositing', compositing)
+    observe_stage('encoding', time.perf_counter() - segment_start - compositing)
+    compositor = timeline._compositor
+    if compositor is not None:
+        count_cache('sprite_transform', True, compositor.transform_cache.hits)
+        count_cache('sprite_transform', False, compositor.transform_cache.misses)
+    registry.flush()
+    return segment_path, segment_trace.events if trace else []
+
+
+class SegmentRenderer:
+    """
+    Renders a timeline as keyframe-aligned segments in parallel worker processes (in-process with one worker)
+    Segments are encoded independently with identical settings and joined losslessly by ffmpeg concat;
+    with a title card cache, intro/outro cards are pre-encoded once and only spliced in
+    """
+
+    def __init__(self, workers: Optional[int] = None, gop_seconds: float = 1.0, codec: str = 'libx264',
+                 preset: str = 'medium', crf: Optional[int] = None, title_cache_dir: Optional[str] = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.gop_seconds = gop_seconds
+        self.codec = codec
+        self.preset = preset
+        self.crf = crf
+        self.title_cache = TitleCardCache(title_cache_dir) if title_cache_dir else None
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # Several pipeline render threads may share this renderer
+        with self._pool_lock:
+            if self._pool is None:
+                # Spawned workers re-run the launching script's top level as __mp_main__, so entry
+                # points must keep model construction out of it (flask_wrapper builds services lazily)
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def encoder_kwargs(self, fps: float, num_segments: int) -> dict:
+        """Encoder settings shared by every segment so the streams concatenate without re-encoding"""
+        gop_size = self.gop_size(fps)
+        # Fixed GOP with scene-cut keyframes disabled: keyframes land exactly on segment boundaries
+        extra_args = ['-g', str(gop_size), '-keyint_min', str(gop_size), '-sc_threshold', '0']
+        # Share the cores between concurrently running encoders
+        extra_args += ['-threads', str(max(1, (os.cpu_count() or 1) // num_segments))]
+        return {'codec': self.codec, 'preset': self.preset, 'crf': self.crf, 'extra_args': extra_args}
+
+    def gop_size(self, fps: float) -> int:
+        return max(1, int(round(self.gop_seconds * fps)))
+
+    def render(self, timeline: Timeline, output_path: str, loop_only: bool = False) -> str:
+        """
+        Render the timeline to output_path; returns the output path
+        A steady state that repeats exactly is encoded once and repeated by the concat playlist, which
+        leaves the video unchanged. With loop_only, one period of a loop matching within
+        LOOP_TOLERANCES is written, for seamless looping playback; raises ValueError if the scene
+        never settles into a loop.
+        """
+        gop_size = self.gop_size(timeline.fps)
+        start, stop = 0, timeline.num_frames
+        scene_start = timeline.intro_frames
+        scene_stop = scene_start + timeline.plan.num_frames
+
+        # Cached title segments replace the title frames at the ends of the timeline
+        head, tail = [], []
+        if loop_only:
+            start, stop = scene_start, scene_stop
+        elif self.title_cache is not None:
+            title_kwargs = self.encoder_kwargs(timeline.fps, 1)
+            if timeline.intro_frames:
+                head.append(self._title_segment(timeline, timeline.intro_text, True, title_kwargs))
+                start = scene_start
+            if timeline.outro_frames:
+                tail.append(self._title_segment(timeline, timeline.outro_text, False, title_kwargs))
+                stop = scene_stop
+
+        # Pieces of the playlist as (start, stop, repeats) timeline frame ranges
+        # Approximate loops are only for the optional looping output; a full render must not change
+        loop = timeline.plan.detect_loop(tolerances=None if loop_only else EXACT_LOOP_TOLERANCES)
+        if loop_only:
+            if loop is None:
+                raise ValueError("Scene has no repeating steady state to loop")
+            loop_start, period = scene_start + loop[0], loop[1]
+            pieces = [(loop_start, loop_start + period, 1)]
+        elif loop is not None:
+            loop_start, period = scene_start + loop[0], loop[1]
+            repeats, remainder = divmod(scene_stop - loop_start, period)
+            print(f"♻️ Scene repeats every {period} frames from frame {loop[0]}; encoding one period")
+            pieces = [
+                (start, loop_start, 1),
+                (loop_start, loop_start + period, repeats),
+                (loop_start, loop_start + remainder, 1),
+                (scene_stop, stop, 1),
+            ]
+        else:
+            pieces = [(start, stop, 1)]
+        pieces = [piece for piece in pieces if piece[0] < piece[1]]
+
+        # Give each piece a share of the workers proportional to its length
+        total = sum(piece_stop - piece_start for piece_start, piece_stop, _ in pieces)
+        piece_segments = []
+        for piece_start, piece_stop, _ in pieces:
+            share = max(1, round(self.workers * (piece_stop - piece_start) / total))
+            piece_segments.append([
+                (piece_start + s, piece_start + e) for s, e in plan_segments(piece_stop - piece_start, gop_size, share)
+            ])
+        segments = [segment for segment_list in piece_segments for segment in segment_list]
+        # Encoders only compete for cores when segments render concurrently
+        encoder_kwargs = self.encoder_kwargs(timeline.fps, min(len(segments), self.workers))
+
+        if len(segments) == 1 and not head and not tail and pieces[0][2] == 1:
+            return _render_segment(timeline, segments[0][0], segments[0][1], output_path, encoder_kwargs)[0]
+
+        output_dir = os.path.dirname(os.path.abspath(output_path))
+        os.makedirs(output_dir, exist_ok=True)
+        segment_dir = tempfile.mkdtemp(prefix='.segments_', dir=output_dir)
+        try:
+            segment_paths = [os.path.join(segment_dir, f"segment_{i:03d}.mp4") for i in range(len(segments))]
+            self._render_segments(timeline, segments, segment_paths, encoder_kwargs)
+
+            # Repeated pieces list the same segment files again: repetition happens in the container
+            playlist = list(head)
+            paths = iter(segment_paths)
+            for (_, _, repeats), segment_list in zip(pieces, piece_segments):
+                piece_paths = [next(paths) for _ in segment_list]
+                playlist += piece_paths * repeats
+            playlist += tail
+
+            with time_stage('concat'), span('concat', segments=len(playlist)):
+                concat_segments(playlist, output_path)
+        finally:
+            shutil.rmtree(segment_dir, ignore_errors=True)
+
+        return output_path
+
+    def _render_segments(self, timeline: Timeline, segments: List[Tuple[int, int]], segment_paths: List[str],
+                         encoder_kwargs: dict):
+        # A single worker gains nothing from a process pool and would pay for spawning and pickling the plan
+        if len(segments) == 1 or self.workers == 1:
+            for (seg_start, seg_stop), path in zip(segments, segment_paths):
+                _render_segment(timeline, seg_start, seg_stop, path, encoder_kwargs)
+            return
+
+        pool = self._get_pool()
+        # Worker processes cannot see this thread's trace; they return their spans instead
+        trace = current_trace()
+        futures = [
+            pool.submit(_render_segment, timeline, seg_start, seg_stop, path, encoder_kwargs, trace is not None)
+            for (seg_start, seg_stop), path in zip(segments, segment_paths)
+        ]
+        for future in futures:
+            _, events = future.result()
+            if trace is not None:
+                trace.extend(events)
+
+    def _title_segment(self, timeline: Timeline, text: str, is_intro: bool, encoder_kwargs: dict) -> str:
+        return self.title_cache.get(text, timeline.canvas_size, timeline.fps, timeline.title_seconds,
+                                    is_intro, encoder_kwargs)
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
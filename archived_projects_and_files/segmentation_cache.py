@@ -0,0 +1,127 @@
+import hashlib
+import io
+import json
+import os
+import numpy as np
+from typing import Dict, List, Optional
+from element_record import ElementRecord
+
+class SegmentationCache:
+    """
+    Content-addressed on-disk cache for processed segmentation results
+    Entries are keyed by image bytes plus segmentation parameters and evicted LRU by total size
+    """
+
+    # Bump when the element format or mask post-processing changes
+    FORMAT_VERSION = 2
+
+    def __init__(self, cache_dir: str, max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, image_bytes: bytes, params: Dict) -> str:
+        """Hash the raw image bytes together with the parameters that affect segmentation"""
+        hasher = hashlib.sha256()
+        hasher.update(image_bytes)
+        hasher.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+        hasher.update(str(self.FORMAT_VERSION).encode("utf-8"))
+        return hasher.hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get(self, key: str) -> Optional[List[ElementRecord]]:
+        """Load cached elements, or None on a miss"""
+        path = self._entry_path(key)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                records = json.loads(str(data['records']))
+                elements = []
+                for i, record in enumerate(records):
+                    elements.append(ElementRecord(
+                        record['type'],
+                        image=data[f'image_{i}'],
+                        mask=None,
+                        packed_mask=data[f'mask_{i}'],
+                        mask_shape=record['mask_shape'],
+                        bbox=record['bbox'],
+                        center=record['center'],
+                        area=record['area'],
+                        stability_score=record['stability_score'],
+                        predicted_iou=record['predicted_iou'],
+                        aspect_ratio=record['aspect_ratio'],
+                        parent=record.get('parent'),
+                        children=record.get('children'),
+                    ))
+
+            # Refresh recency for LRU eviction
+            os.utime(path, None)
+            return elements
+
+        except Exception as e:
+            print(f"⚠️ Segmentation cache entry unreadable, discarding: {e}")
+            self._remove(path)
+            return None
+
+    def put(self, key: str, elements: List[ElementRecord]):
+        """Store elements as compressed arrays plus a JSON record per element"""
+        arrays = {}
+        records = []
+
+        for i, element in enumerate(elements):
+            # Masks are already bit-packed in the record
+            arrays[f'image_{i}'] = np.ascontiguousarray(element.image)
+            arrays[f'mask_{i}'] = element.packed_mask
+
+            record = element.scalar_fields()
+            record['mask_shape'] = list(element.mask_shape)
+            records.append(record)
+
+        arrays['records'] = np.array(json.dumps(records))
+
+        path = self._entry_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            buffer = io.BytesIO()
+            np.savez_compressed(buffer, **arrays)
+            with open(tmp_path, 'wb') as f:
+                f.write(buffer.getvalue())
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"⚠️ Could not write segmentation cache entry: {e}")
+            self._remove(tmp_path)
+            return
+
+        self._evict()
+
+    def _evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.npz'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
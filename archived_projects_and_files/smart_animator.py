@@ -1,9 +1,12 @@
 import numpy as np
-from moviepy.editor import *
 from typing import Dict, List, Tuple
 import random
+import sys
 import cv2
 from PIL import Image # Added PIL import
+from metrics import count_fallback
+from scene_compositor import render_title_card
+from scene_plan import Behavior, ElementTrack, ScenePlan
 
 class AnimationElement:
     """Wrapper class for animated elements"""
@@ -54,11 +57,11 @@ class SmartAnimator:
         }
     
     def _create_smooth_easing(self, t, duration, ease_type='ease_in_out'):
-        """Create smooth easing functions for natural movement"""
+        """Create smooth easing functions for natural movement (t may be a scalar or NumPy array)"""
         if duration <= 0:
             return 1.0
             
-        progress = min(t / duration, 1.0)
+        progress = np.minimum(np.asarray(t, dtype=np.float64) / duration, 1.0)
         
         if ease_type == 'ease_in_out':
             # Smooth acceleration and deceleration (most natural)
@@ -71,194 +74,248 @@ class SmartAnimator:
             return progress ** 3
         elif ease_type == 'bounce':
             # Bouncy easing for playful elements
-            if progress < 0.5:
-                return 2 * progress * progress
-            else:
-                return 1 - 2 * (1 - progress) * (1 - progress)
+            return np.where(progress < 0.5,
+                            2 * progress * progress,
+                            1 - 2 * (1 - progress) * (1 - progress))
         else:
             return progress
     
 
-    def create_coordinated_animation(self, element_clips_data, original_image_path, user_story=None):
+    def create_coordinated_animation(self, element_clips_data, original_image_path, user_story=None, fps=24):
         """Create coordinated animations where elements move in harmony"""
+        # MoviePy is only needed to build clips; compile_scene and the NumPy compositor work without it
+        from moviepy.editor import ImageClip
         print("🎬 Creating coordinated seamless animations...")
         
-        all_clips = []
-        scene_time = self._extract_scene_time(user_story)
+        # Compile the whole scene to a keyframe table first; clips only look values up
+        plan = self.compile_scene(element_clips_data, original_image_path, user_story, fps)
+        
+        all_clips = [ImageClip(plan.background).set_duration(self.animation_duration)]
+        
+        for row, track in enumerate(plan.tracks):
+            # The keyframes position the trimmed sprite (they include track.offset), so the clip is
+            # built from it rather than from the untrimmed source clip; RGBA alpha becomes the clip mask
+            element_clip = ImageClip(track.sprite, duration=self.animation_duration)
 
-        # 1. Load and add the original image as background
+            try:
+                all_clips.append(self._clip_from_track(element_clip, plan, row))
+                print(f"✅ Coordinated {track.label} animation")
+                
+            except Exception as e:
+                print(f"⚠️ Failed to coordinate {track.label}: {e}", file=sys.stderr)
+                count_fallback('element_animation_failed')
+                # Fallback to simple positioning if the animated clip cannot be built
+                x, y = element_clips_data[track.index]['info']['center']
+                try:
+                    simple_clip = element_clip.set_position(lambda t: (int(x), int(y))).set_duration(self.animation_duration)
+                    all_clips.append(simple_clip)
+                    print(f"✅ Fallback simple animation for {track.label}")
+                    
+                except Exception as e_fallback:
+                    print(f"⚠️ Final fallback failed for {track.label}: {e_fallback}", file=sys.stderr)
+                    continue
+                  
+        return all_clips
+    
+    def compile_scene(self, element_clips_data, original_image_path, user_story=None, fps=24) -> ScenePlan:
+        """Compile background, element sprites and behaviors into a per-frame keyframe table"""
+        scene_time = self._extract_scene_time(user_story)
+        
+        # 1. Load the original image as background
         try:
             original_image = Image.open(original_image_path).convert('RGB')
             original_image_np = np.array(original_image)
             # Resize original image to canvas size
-            original_image_resized = cv2.resize(original_image_np, self.canvas_size, interpolation=cv2.INTER_AREA)
-            background_clip = ImageClip(original_image_resized).set_duration(self.animation_duration)
-            all_clips.append(background_clip)
+            background = cv2.resize(original_image_np, self.canvas_size, interpolation=cv2.INTER_AREA)
             print("✅ Original image added as background.")
         except Exception as e:
             print(f"⚠️ Could not load or use original image as background: {e}. Using default white background.", file=sys.stderr)
             # Fallback to a white background if original image fails
-            white_bg = np.full((self.canvas_size[1], self.canvas_size[0], 3), 255, dtype=np.uint8)
-            background_clip = ImageClip(white_bg).set_duration(self.animation_duration)
-            all_clips.append(background_clip)
+            background = np.full((self.canvas_size[1], self.canvas_size[0], 3), 255, dtype=np.uint8)
         
         # Sort elements by layer for proper rendering
         layer_order = {'background': 0, 'midground': 1, 'foreground': 2}
         # Filter out elements that are too small or problematic
-        filtered_elements_data = [e for e in element_clips_data if e['info']['area'] > 500] # Filter out very small elements
-        filtered_elements_data.sort(key=lambda x: layer_order.get(x['classification']['layer'], 1))
-        
-        for i, element_data in enumerate(filtered_elements_data):
-            element_clip = element_data['clip']
+        ordered = [
+            (source_index, element_data) for source_index, element_data in enumerate(element_clips_data)
+            if element_data['info']['area'] > 500  # Filter out very small elements
+        ]
+        ordered.sort(key=lambda item: layer_order.get(item[1]['classification']['layer'], 1))
+        
+        tracks = []
+        for i, (source_index, element_data) in enumerate(ordered):
             classification = element_data['classification']
             element_info = element_data['info']
             
             try:
-                # Apply coordinated animation based on layer
-                if classification['layer'] == 'background':
-                    animated_clip = self._create_background_coordination(
-                        element_clip, element_info, classification, user_story, scene_time
-                    )
-                elif classification['layer'] == 'midground':
-                    animated_clip = self._create_midground_coordination(
-                        element_clip, element_info, classification, user_story, scene_time
-                    )
-                else:  # foreground
-                    animated_clip = self._create_foreground_coordination(
-                        element_clip, element_info, classification, user_story, scene_time, i
-                    )
-                
-                if animated_clip:
-                    all_clips.append(animated_clip)
-                    print(f"✅ Coordinated {classification['label']} animation")
-                
+                behavior = self._create_behavior(element_info, classification, user_story, scene_time, i)
             except Exception as e:
                 print(f"⚠️ Failed to coordinate {classification['label']}: {e}", file=sys.stderr)
+                count_fallback('element_animation_failed')
                 # Fallback to simple positioning if specific animation fails
-                x, y = element_info['center']
-                try:
-                    # Ensure element_clip is a MoviePy clip
-                    if not isinstance(element_clip, ImageClip):
-                        # Convert numpy array to MoviePy ImageClip if it's still a numpy array
-                        if isinstance(element_clip, np.ndarray):
-                            element_clip = ImageClip(element_clip, duration=self.animation_duration)
-                        else:
-                            # If it's neither, skip or create a placeholder
-                            print(f"⚠️ Element clip for {classification['label']} is not a valid type. Skipping.", file=sys.stderr)
-                            continue
+                behavior = self._create_static_behavior(element_info)
+            
+            sprite, offset = self._element_sprite(element_data)
+            tracks.append(ElementTrack(
+                index=source_index,
+                label=classification['label'],
+                layer=classification['layer'],
+                sprite=sprite,
+                bbox=tuple(element_info['bbox']),
+                behavior=behavior,
+                offset=offset,
+            ))
+        
+        return ScenePlan(self.canvas_size, fps, self.animation_duration, background, tracks,
+                         metadata={'user_story': user_story, 'scene_time': scene_time})
+    
+    def _element_sprite(self, element_data) -> Tuple[np.ndarray, Tuple[int, int]]:
+        """
+        Sprite pixels for an element plus their offset inside the element bbox
+        Segmentation records give RGBA with the mask as alpha, trimmed to the tight alpha bounds
+        """
+        element_info = element_data['info']
+        if hasattr(element_info, 'rgba'):
+            element_image = element_info.rgba()
+        else:
+            element_clip = element_data['clip']
+            element_image = element_clip if isinstance(element_clip, np.ndarray) else element_clip.get_frame(0)
 
-                    simple_clip = element_clip.set_position(lambda t: (int(x), int(y))).set_duration(self.animation_duration)
-                    all_clips.append(simple_clip)
-                    print(f"✅ Fallback simple animation for {classification['label']}")
-                    
-                except Exception as e_fallback:
-                    print(f"⚠️ Final fallback failed for {classification['label']}: {e_fallback}", file=sys.stderr)
-                    continue
-                  
-        return all_clips
+        if element_image.ndim != 3 or element_image.shape[2] != 4:
+            return element_image, (0, 0)
+        
+        # Fully transparent borders cost blending time and nothing else
+        rows = np.nonzero(element_image[:, :, 3].any(axis=1))[0]
+        cols = np.nonzero(element_image[:, :, 3].any(axis=0))[0]
+        if len(rows) == 0:
+            return element_image, (0, 0)
+        y0, y1, x0, x1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        return np.ascontiguousarray(element_image[y0:y1, x0:x1]), (int(x0), int(y0))
+    
+    def _clip_from_track(self, element_clip, plan: ScenePlan, row: int):
+        """Drive a MoviePy clip from one row of the compiled keyframe table"""
+        behavior = plan.tracks[row].behavior
+        keyframes = plan.keyframes
+        
+        def frame_at(t):
+            # Clip time is local to the clip's start
+            return plan.frame_index(behavior.start + t)
+        
+        clip = element_clip.set_position(
+            lambda t: (int(keyframes['x'][row, frame_at(t)]), int(keyframes['y'][row, frame_at(t)]))
+        )
+        # Rotated corners and animated opacity need a mask; added first so resize/rotate transform it too
+        if clip.mask is None and (behavior.rotation is not None or behavior.opacity is not None):
+            clip = clip.add_mask()
+        # Scale before rotating: a resize function scales the clip's original size, not the rotated frame's
+        if behavior.scale is not None:
+            clip = clip.resize(lambda t: float(keyframes['scale'][row, frame_at(t)]))
+        if behavior.rotation is not None:
+            clip = clip.rotate(lambda t: float(keyframes['rotation'][row, frame_at(t)]))
+        if behavior.opacity is not None:
+            # set_opacity only takes a constant; animated opacity scales the mask frame by frame
+            clip = clip.set_mask(clip.mask.fl(lambda get_frame, t: get_frame(t) * float(keyframes['opacity'][row, frame_at(t)])))
+        
+        return clip.set_start(behavior.start)
+    
+    def _create_behavior(self, element_info, classification, user_story, scene_time, index) -> Behavior:
+        """Pick the coordinated behavior for an element based on its layer"""
+        if classification['layer'] == 'background':
+            return self._create_background_coordination(element_info, classification, user_story, scene_time)
+        elif classification['layer'] == 'midground':
+            return self._create_midground_coordination(element_info, classification, user_story, scene_time)
+        else:  # foreground
+            return self._create_foreground_coordination(element_info, classification, user_story, scene_time, index)
     
-    def _create_background_coordination(self, element_clip, element_info, classification, user_story, scene_time):
+    def _create_background_coordination(self, element_info, classification, user_story, scene_time):
         """Background elements: subtle, continuous, seamless movement"""
         object_label = classification['label']
         
         if object_label == 'sun':
-            return self._create_seamless_sun_animation(element_clip, element_info, user_story, scene_time)
-        elif object_label == 'moon':
-            return self._create_seamless_moon_animation(element_clip, element_info, user_story, scene_time)
+            return self._create_seamless_sun_animation(element_info, user_story, scene_time)
         elif object_label == 'cloud':
-            return self._create_seamless_cloud_animation(element_clip, element_info, user_story)
+            return self._create_seamless_cloud_animation(element_info, user_story)
         elif object_label == 'star':
-            return self._create_seamless_star_animation(element_clip, element_info)
-        elif object_label == 'rainbow':
-            return self._create_seamless_rainbow_animation(element_clip, element_info, self.animation_duration)
+            return self._create_seamless_star_animation(element_info)
+        elif object_label in ['moon', 'rainbow']:
+            # No dedicated behavior yet; placed like the coordination fallback
+            return self._create_static_behavior(element_info)
         else:
-            return self._create_gentle_background_motion(element_clip, element_info)
+            return self._create_gentle_background_motion(element_info)
     
-    def _create_midground_coordination(self, element_clip, element_info, classification, user_story, scene_time):
+    def _create_midground_coordination(self, element_info, classification, user_story, scene_time):
         """Midground elements: moderate movement, story-responsive"""
         object_label = classification['label']
         
         if object_label in ['tree', 'grass']:
-            return self._create_seamless_swaying_animation(element_clip, element_info)
+            return self._create_seamless_swaying_animation(element_info)
         elif object_label in ['house', 'building', 'mountain']:
-            return self._create_seamless_breathing_animation(element_clip, element_info)
-        elif object_label in ['water', 'river']:
-            return self._create_seamless_flowing_animation(element_clip, element_info)
-        elif object_label == 'boat':
-            return self._create_seamless_floating_animation(element_clip, element_info, self.animation_duration)
+            return self._create_seamless_breathing_animation(element_info)
         else:
-            return self._create_gentle_midground_motion(element_clip, element_info)
+            # water, river, boat and unclassified midground elements have no dedicated behavior yet
+            return self._create_static_behavior(element_info)
     
-    def _create_foreground_coordination(self, element_clip, element_info, classification, user_story, scene_time, index):
+    def _create_foreground_coordination(self, element_info, classification, user_story, scene_time, index):
         """Foreground elements: dynamic movement, main focus"""
         object_label = classification['label']
         story_cues = self._parse_story_context(user_story, object_label, scene_time)
         
         if object_label in ['animal', 'dog', 'cat', 'person', 'child']:
-            return self._create_seamless_walking_animation(element_clip, element_info, story_cues, index)
-        elif object_label == 'bird':
-            return self._create_seamless_flying_animation(element_clip, element_info, story_cues)
-        elif object_label == 'car':
-            return self._create_seamless_driving_animation(element_clip, element_info, story_cues)
+            return self._create_seamless_walking_animation(element_info, story_cues, index)
+        elif object_label in ['bird', 'airplane', 'kite']:
+            return self._create_seamless_flying_animation(element_info, story_cues) # Airplanes and kites also fly
+        elif object_label in ['car', 'bicycle', 'train']:
+            return self._create_seamless_driving_animation(element_info, story_cues) # Bicycles and trains also drive
         elif object_label == 'flower':
-            return self._create_seamless_growing_animation(element_clip, element_info, story_cues)
-        elif object_label in ['fish']:
-            return self._create_seamless_swimming_animation(element_clip, element_info, self.animation_duration)
-        elif object_label == 'ball':
-            return self._create_seamless_bouncing_animation(element_clip, element_info, self.animation_duration)
-        elif object_label == 'butterfly':
-            return self._create_seamless_fluttering_animation(element_clip, element_info, self.animation_duration)
-        elif object_label == 'airplane':
-            return self._create_seamless_flying_animation(element_clip, element_info, story_cues) # Airplanes also fly
-        elif object_label == 'balloon':
-            return self._create_seamless_floating_animation(element_clip, element_info, self.animation_duration)
-        elif object_label == 'kite':
-            return self._create_seamless_flying_animation(element_clip, element_info, story_cues) # Kites also fly
-        elif object_label == 'bicycle':
-            return self._create_seamless_driving_animation(element_clip, element_info, story_cues) # Bicycles also drive
-        elif object_label == 'train':
-            return self._create_seamless_driving_animation(element_clip, element_info, story_cues) # Trains also drive
-        elif object_label == 'swing':
-            return self._create_seamless_swinging_animation(element_clip, element_info, self.animation_duration)
+            return self._create_seamless_growing_animation(element_info, story_cues)
         elif object_label == 'slide':
-            return self._create_seamless_breathing_animation(element_clip, element_info) # Slides are static
+            return self._create_seamless_breathing_animation(element_info) # Slides are static
         elif object_label == 'umbrella':
-            return self._create_seamless_swaying_animation(element_clip, element_info) # Umbrellas can sway
+            return self._create_seamless_swaying_animation(element_info) # Umbrellas can sway
+        elif object_label in ['fish', 'ball', 'butterfly', 'balloon', 'swing']:
+            # No dedicated behavior yet; placed like the coordination fallback
+            return self._create_static_behavior(element_info)
         else:
-            return self._create_gentle_foreground_motion(element_clip, element_info, index)
+            return self._create_gentle_foreground_motion(element_info, index)
+    
+    def _create_static_behavior(self, element_info):
+        """Simple fixed placement used when no specific animation applies"""
+        x, y = element_info['center']
+        
+        def static_position(t):
+            return (x, y)
+        
+        return Behavior('static', static_position, start=0, params={'x': x, 'y': y})
     
-    def _create_seamless_sun_animation(self, element_clip, element_info, user_story, scene_time):
+    def _create_seamless_sun_animation(self, element_info, user_story, scene_time):
         """Enhanced sun animation with smooth easing and natural arc"""
         x, y, w, h = element_info['bbox']
         
+        # Determine sun path based on story context
+        if 'sunrise' in (user_story or '').lower() or scene_time == 'morning':
+            start_x, end_x = 50, 640
+            start_y, end_y = 350, 80
+        elif 'sunset' in (user_story or '').lower() or scene_time == 'evening':
+            start_x, end_x = 640, 1200
+            start_y, end_y = 80, 350
+        else:
+            # Normal day arc
+            start_x, end_x = 200, 1080
+            start_y, end_y = 100, 120
+        arc_height = -60
+        
         def sun_position(t):
             # Use smooth easing for natural movement
             progress = self._create_smooth_easing(t, self.animation_duration, 'ease_in_out')
             
-            # Determine sun path based on story context
-            if 'sunrise' in (user_story or '').lower() or scene_time == 'morning':
-                start_x, end_x = 50, 640
-                start_y, end_y = 350, 80
-                start_time = 1
-            elif 'sunset' in (user_story or '').lower() or scene_time == 'evening':
-                start_x, end_x = 640, 1200
-                start_y, end_y = 80, 350
-                start_time = 8
-            else:
-                # Normal day arc
-                start_x, end_x = 200, 1080
-                start_y, end_y = 100, 120
-                start_time = 0
-            
             # Smooth horizontal movement
             x_pos = start_x + (end_x - start_x) * progress
             
             # Natural arc using sine wave with easing
-            arc_height = -60
             arc_progress = np.sin(np.pi * progress)
             y_pos = start_y + (end_y - start_y) * progress + arc_height * arc_progress
             
-            return (int(x_pos), int(y_pos))
+            return (x_pos, y_pos)
         
         def sun_rotation(t):
             # Gentle rotation throughout the day
@@ -269,59 +326,57 @@ class SmartAnimator:
             # Subtle size variation for realism
             return 1.0 + 0.05 * np.sin(2 * np.pi * t / 8)
         
-        return (element_clip
-               .set_position(sun_position)
-               .rotate(sun_rotation)
-               .resize(sun_scale)
-               .set_start(0))
+        return Behavior('sun_arc', sun_position, start=0,
+                        params={'start': (start_x, start_y), 'end': (end_x, end_y), 'arc_height': arc_height,
+                                'duration': self.animation_duration},
+                        rotation=sun_rotation, scale=sun_scale)
     
-    def _create_seamless_cloud_animation(self, element_clip, element_info, user_story):
+    def _create_seamless_cloud_animation(self, element_info, user_story):
         """Enhanced cloud animation with smooth transitions"""
         x, y, w, h = element_info['bbox']
         
         def cloud_position(t):
-            # Phase-based movement for seamless transitions
-            if t < 2:
-                # Gentle entry phase
-                entry_progress = self._create_smooth_easing(t, 2, 'ease_out')
-                base_x = -150 + (x + 150) * entry_progress
-                base_y = y + 3 * np.sin(2 * np.pi * t / 10)
-            elif t < 13:
-                # Main drift phase
-                drift_time = t - 2
-                base_x = x + 25 * drift_time
-                base_y = y + 8 * np.sin(2 * np.pi * drift_time / 12)
-            else:
-                # Gentle exit phase
-                exit_time = t - 13
-                exit_progress = self._create_smooth_easing(exit_time, 2, 'ease_in')
-                base_x = x + 25 * 11 + 150 * exit_progress
-                base_y = y + 8 * np.sin(2 * np.pi * (11 + exit_time) / 12)
+            # Phase-based movement for seamless transitions, evaluated for all phases then selected
+            # Gentle entry phase
+            entry_progress = self._create_smooth_easing(t, 2, 'ease_out')
+            entry_x = -150 + (x + 150) * entry_progress
+            entry_y = y + 3 * np.sin(2 * np.pi * t / 10)
+            
+            # Main drift phase
+            drift_time = t - 2
+            drift_x = x + 25 * drift_time
+            drift_y = y + 8 * np.sin(2 * np.pi * drift_time / 12)
+            
+            # Gentle exit phase
+            exit_time = t - 13
+            exit_progress = self._create_smooth_easing(exit_time, 2, 'ease_in')
+            exit_x = x + 25 * 11 + 150 * exit_progress
+            exit_y = y + 8 * np.sin(2 * np.pi * (11 + exit_time) / 12)
+            
+            base_x = np.where(t < 2, entry_x, np.where(t < 13, drift_x, exit_x))
+            base_y = np.where(t < 2, entry_y, np.where(t < 13, drift_y, exit_y))
             
             # Add natural randomness
             noise_x = 4 * np.sin(3 * np.pi * t / 13)
             noise_y = 2 * np.cos(5 * np.pi * t / 17)
             
-            return (int(base_x + noise_x), int(base_y + noise_y))
+            return (base_x + noise_x, base_y + noise_y)
         
         def cloud_opacity(t):
-            # Smooth fade in/out
-            if t < 1:
-                return self._create_smooth_easing(t, 1, 'ease_out')
-            elif t > 14:
-                return 1 - self._create_smooth_easing(t - 14, 1, 'ease_in')
-            else:
-                return 0.9 + 0.1 * np.sin(2 * np.pi * t / 8)  # Subtle opacity variation
-        
-        return (element_clip
-               .set_position(cloud_position)
-               .set_opacity(cloud_opacity)
-               .set_start(1))
+            # Smooth fade in/out with subtle opacity variation in between
+            return np.where(t < 1, self._create_smooth_easing(t, 1, 'ease_out'),
+                            np.where(t > 14, 1 - self._create_smooth_easing(t - 14, 1, 'ease_in'),
+                                     0.9 + 0.1 * np.sin(2 * np.pi * t / 8)))
+        
+        return Behavior('cloud_drift', cloud_position, start=1,
+                        params={'x': x, 'y': y, 'drift_speed': 25},
+                        opacity=cloud_opacity)
     
-    def _create_seamless_walking_animation(self, element_clip, element_info, story_cues, index):
+    def _create_seamless_walking_animation(self, element_info, story_cues, index):
         """Enhanced walking animation with perfect loops and character variation"""
         x, y, w, h = element_info['bbox']
         speed_modifier = story_cues.get('speed_modifier', 1.0)
+        special_cues = story_cues.get('special_cues', [])
         
         # Character-specific parameters
         char_params = {
@@ -330,22 +385,19 @@ class SmartAnimator:
             'bounce_frequency': 8 + index,
             'start_delay': index * 0.8
         }
+        loop_duration = 6  # 6-second walking cycle
         
         def walking_position(t):
             # Adjust for start delay
-            effective_t = max(0, t - char_params['start_delay'])
-            
-            if effective_t == 0:
-                return (x, y)
+            effective_t = np.maximum(0, t - char_params['start_delay'])
             
             # Create perfect loop cycle
-            loop_duration = 6  # 6-second walking cycle
             loop_time = effective_t % loop_duration
             
             walk_speed = char_params['base_speed'] * speed_modifier
             
             # Smooth horizontal movement with easing
-            if 'playful' in story_cues.get('special_cues', []):
+            if 'playful' in special_cues:
                 # Playful zigzag movement
                 zigzag = 15 * np.sin(4 * np.pi * loop_time / loop_duration)
                 new_x = x + (walk_speed * effective_t) + zigzag
@@ -356,37 +408,40 @@ class SmartAnimator:
             # Natural bouncing with perfect loop
             bounce_cycles = 4  # 4 bounces per loop
             bounce_progress = (loop_time / loop_duration) * bounce_cycles
-            bounce = char_params['bounce_height'] * abs(np.sin(2 * np.pi * bounce_progress))
+            bounce = char_params['bounce_height'] * np.abs(np.sin(2 * np.pi * bounce_progress))
             
             # Add subtle randomness for natural feel
-            if 'running' in story_cues.get('special_cues', []):
-                bounce *= 1.5  # Higher bounces when running
+            if 'running' in special_cues:
+                bounce = bounce * 1.5  # Higher bounces when running
             
             new_y = y - bounce
             
             # Seamless screen wrapping
             screen_width = 1280
-            if new_x > screen_width + 50:
-                new_x = (new_x % (screen_width + 100)) - 50
+            new_x = np.where(new_x > screen_width + 50, (new_x % (screen_width + 100)) - 50, new_x)
             
-            return (int(new_x), int(new_y))
+            # Stay put until the start delay has passed
+            not_started = effective_t == 0
+            return (np.where(not_started, x, new_x), np.where(not_started, y, new_y))
         
         def walking_scale(t):
             # Subtle scale variation for depth
-            effective_t = max(0, t - char_params['start_delay'])
+            effective_t = np.maximum(0, t - char_params['start_delay'])
             return 1.0 + 0.02 * np.sin(6 * np.pi * effective_t)
         
-        return (element_clip
-               .set_position(walking_position)
-               .resize(walking_scale)
-               .set_start(char_params['start_delay']))
+        return Behavior('walk', walking_position, start=char_params['start_delay'],
+                        params={'x': x, 'y': y, 'speed': char_params['base_speed'] * speed_modifier,
+                                'bounce_height': char_params['bounce_height'], 'loop_duration': loop_duration,
+                                'delay': char_params['start_delay'], 'special_cues': list(special_cues)},
+                        scale=walking_scale)
     
-    def _create_seamless_flying_animation(self, element_clip, element_info, story_cues):
+    def _create_seamless_flying_animation(self, element_info, story_cues):
         """Enhanced flying animation with natural wing patterns"""
         x, y, w, h = element_info['bbox']
+        soaring = 'soaring' in story_cues.get('special_cues', [])
         
         def flying_position(t):
-            if 'soaring' in story_cues.get('special_cues', []):
+            if soaring:
                 # Soaring in wide, slow circles
                 circle_radius = 120
                 circle_frequency = 0.3
@@ -412,10 +467,9 @@ class SmartAnimator:
                 new_y = y + wave_y
                 
                 # Seamless looping
-                if new_x > 1350:
-                    new_x = -100
+                new_x = np.where(new_x > 1350, -100, new_x)
             
-            return (int(new_x), int(new_y))
+            return (new_x, new_y)
         
         def wing_rotation(t):
             # Realistic wing flapping with varying speed
@@ -427,13 +481,11 @@ class SmartAnimator:
             # Subtle size variation for depth perception
             return 1.0 + 0.03 * np.sin(8 * np.pi * t)
         
-        return (element_clip
-               .set_position(flying_position)
-               .rotate(wing_rotation)
-               .resize(flying_scale)
-               .set_start(2))
+        return Behavior('fly', flying_position, start=2,
+                        params={'x': x, 'y': y, 'soaring': soaring},
+                        rotation=wing_rotation, scale=flying_scale)
     
-    def _create_seamless_swaying_animation(self, element_clip, element_info):
+    def _create_seamless_swaying_animation(self, element_info):
         """Enhanced swaying for trees with wind variation"""
         x, y, w, h = element_info['bbox']
         
@@ -456,18 +508,17 @@ class SmartAnimator:
             sway_offset = 2 * np.sin(2 * np.pi * t / 4)
             return (x + sway_offset, y)
         
-        return (element_clip
-               .set_position(sway_position)
-               .rotate(sway_rotation)
-               .set_start(0.5))
+        return Behavior('sway', sway_position, start=0.5,
+                        params={'x': x, 'y': y, 'period': 4},
+                        rotation=sway_rotation)
     
-    def _create_seamless_breathing_animation(self, element_clip, element_info):
+    def _create_seamless_breathing_animation(self, element_info):
         """Enhanced breathing for static objects"""
         x, y, w, h = element_info['bbox']
+        breath_rate = 0.8  # Slow, calm breathing
         
         def breathing_scale(t):
             # Natural breathing rhythm
-            breath_rate = 0.8  # Slow, calm breathing
             return 1.0 + 0.015 * np.sin(2 * np.pi * t * breath_rate)
         
         def subtle_movement(t):
@@ -476,65 +527,44 @@ class SmartAnimator:
             micro_y = 0.5 * np.cos(2 * np.pi * t / 18)
             return (x + micro_x, y + micro_y)
         
-        return (element_clip
-               .set_position(subtle_movement)
-               .resize(breathing_scale)
-               .set_start(0))
+        return Behavior('breathing', subtle_movement, start=0,
+                        params={'x': x, 'y': y, 'breath_rate': breath_rate},
+                        scale=breathing_scale)
     
-    def _create_seamless_growing_animation(self, element_clip, element_info, story_cues):
+    def _create_seamless_growing_animation(self, element_info, story_cues):
         """Enhanced growing animation for flowers"""
         x, y, w, h = element_info['bbox']
         
         def growth_scale(t):
-            if t < 4:
-                # Natural growth curve
-                growth_progress = self._create_smooth_easing(t, 4, 'ease_out')
-                return 0.1 + 0.9 * growth_progress
-            else:
-                # Gentle swaying after growth
-                sway_time = t - 4
-                base_scale = 1.0
-                sway_scale = 0.03 * np.sin(2 * np.pi * sway_time / 6)
-                return base_scale + sway_scale
+            # Natural growth curve, then gentle swaying after growth
+            growth_progress = self._create_smooth_easing(t, 4, 'ease_out')
+            sway_scale = 0.03 * np.sin(2 * np.pi * (t - 4) / 6)
+            return np.where(t < 4, 0.1 + 0.9 * growth_progress, 1.0 + sway_scale)
         
         def growth_position(t):
-            if t < 4:
-                # Grow from ground up
-                growth_progress = self._create_smooth_easing(t, 4, 'ease_out')
-                offset_y = 15 * (1 - growth_progress)
-                return (x, y + offset_y)
-            else:
-                # Gentle swaying
-                sway_time = t - 4
-                sway_x = 3 * np.sin(2 * np.pi * sway_time / 6)
-                return (x + sway_x, y)
+            # Grow from ground up, then sway gently
+            growth_progress = self._create_smooth_easing(t, 4, 'ease_out')
+            offset_y = 15 * (1 - growth_progress)
+            sway_x = 3 * np.sin(2 * np.pi * (t - 4) / 6)
+            return (np.where(t < 4, x, x + sway_x), np.where(t < 4, y + offset_y, y))
         
         def growth_opacity(t):
-            if t < 1:
-                return self._create_smooth_easing(t, 1, 'ease_out')
-            else:
-                return 1.0
+            return np.where(t < 1, self._create_smooth_easing(t, 1, 'ease_out'), 1.0)
         
-        return (element_clip
-               .set_position(growth_position)
-               .resize(growth_scale)
-               .set_opacity(growth_opacity)
-               .set_start(4))
+        return Behavior('grow', growth_position, start=4,
+                        params={'x': x, 'y': y, 'growth_duration': 4},
+                        scale=growth_scale, opacity=growth_opacity)
     
-    def _create_seamless_driving_animation(self, element_clip, element_info, story_cues):
+    def _create_seamless_driving_animation(self, element_info, story_cues):
         """Enhanced driving animation with realistic movement"""
         x, y, w, h = element_info['bbox']
         speed_modifier = story_cues.get('speed_modifier', 1.0)
+        drive_speed = 100 * speed_modifier
         
         def driving_position(t):
-            drive_speed = 100 * speed_modifier
-            
             # Smooth acceleration at start
-            if t < 2:
-                accel_progress = self._create_smooth_easing(t, 2, 'ease_out')
-                current_speed = drive_speed * accel_progress
-            else:
-                current_speed = drive_speed
+            accel_progress = self._create_smooth_easing(t, 2, 'ease_out')
+            current_speed = np.where(t < 2, drive_speed * accel_progress, drive_speed)
             
             new_x = x + current_speed * t
             
@@ -543,17 +573,20 @@ class SmartAnimator:
             new_y = y + vibration
             
             # Seamless looping
-            if new_x > 1400:
-                new_x = (new_x % 1500) - 100
+            new_x = np.where(new_x > 1400, (new_x % 1500) - 100, new_x)
             
-            return (int(new_x), int(new_y))
+            return (new_x, new_y)
         
-        return element_clip.set_position(driving_position).set_start(5)
+        return Behavior('drive', driving_position, start=5,
+                        params={'x': x, 'y': y, 'speed': drive_speed})
     
-    def _create_seamless_star_animation(self, element_clip, element_info):
+    def _create_seamless_star_animation(self, element_info):
         """Enhanced twinkling for stars"""
         x, y, w, h = element_info['bbox']
         
+        def star_position(t):
+            return (x, y)
+        
         def twinkling_opacity(t):
             # Multiple twinkling frequencies for natural effect
             base_opacity = 0.8
@@ -562,16 +595,15 @@ class SmartAnimator:
             twinkle3 = 0.1 * np.sin(8.7 * np.pi * t)
             
             total_twinkle = twinkle1 + twinkle2 + twinkle3
-            return max(0.2, base_opacity + total_twinkle)
+            return np.maximum(0.2, base_opacity + total_twinkle)
         
         def twinkling_scale(t):
             return 1.0 + 0.15 * np.sin(6 * np.pi * t)
         
-        return (element_clip
-               .set_position((x, y))
-               .set_opacity(twinkling_opacity)
-               .resize(twinkling_scale)
-               .set_start(0.5))
+        return Behavior('twinkle', star_position, start=0.5,
+                        params={'x': x, 'y': y},
+                        opacity=twinkling_opacity, scale=twinkling_scale)
+
     def _create_seamless_rainbow_animation(self, element_info, duration_frames):
         """Create rainbow animation"""
         frames = []
@@ -644,29 +676,35 @@ class SmartAnimator:
         return frames
 
     
-    def _create_gentle_background_motion(self, element_clip, element_info):
+    def _create_gentle_background_motion(self, element_info):
         """Gentle motion for unclassified background elements"""
         x, y, w, h = element_info['bbox']
         
         def gentle_position(t):
             float_x = x + 5 * np.sin(2 * np.pi * t / 12)
             float_y = y + 3 * np.cos(2 * np.pi * t / 15)
-            return (int(float_x), int(float_y))
+            return (float_x, float_y)
         
-        return element_clip.set_position(gentle_position).set_start(1)
+        return Behavior('gentle_background', gentle_position, start=1, params={'x': x, 'y': y})
     
-    def _create_gentle_foreground_motion(self, element_clip, element_info, index):
+    def _create_gentle_foreground_motion(self, element_info, index):
         """Gentle motion for unclassified foreground elements"""
         x, y, w, h = element_info['bbox']
         start_delay = index * 0.5
         
         def gentle_position(t):
-            effective_t = max(0, t - start_delay)
+            effective_t = np.maximum(0, t - start_delay)
             float_x = x + 8 * np.sin(2 * np.pi * effective_t / 8)
             float_y = y + 4 * np.cos(2 * np.pi * effective_t / 10)
-            return (int(float_x), int(float_y))
+            return (float_x, float_y)
         
-        return element_clip.set_position(gentle_position).set_start(start_delay)
+        return Behavior('gentle_foreground', gentle_position, start=start_delay,
+                        params={'x': x, 'y': y, 'delay': start_delay})
+    
+    def _create_title_card_clip(self, text: str, duration: float, is_intro: bool = True) -> 'ImageClip':
+        """Static intro/outro title card clip at canvas size"""
+        from moviepy.editor import ImageClip
+        return ImageClip(render_title_card(text, self.canvas_size, is_intro)).set_duration(duration)
     
     def _parse_story_context(self, story: str, object_label: str, scene_time: str) -> Dict:
         """Enhanced story parsing for better animation cues"""
@@ -731,7 +769,7 @@ class SmartAnimator:
             return 'day'
     
     # Keep your existing single object animation method for backward compatibility
-    def create_object_animation(self, element_clip, element_info: Dict, classification: Dict, user_story: str = None) -> ImageClip:
+    def create_object_animation(self, element_clip, element_info: Dict, classification: Dict, user_story: str = None) -> 'ImageClip':
         """Backward compatibility method - creates single object animation"""
         # Use the coordinated system for single objects
         element_data = [{
@@ -0,0 +1,98 @@
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple
+
+# Queue sentinel that tells a stage thread to exit
+_STOP = object()
+
+
+class Stage:
+    """One pipeline stage: a bounded input queue drained by a fixed number of threads"""
+
+    def __init__(self, name: str, fn: Callable[[Any], Any], workers: int = 1, queue_size: int = 4):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.threads: List[threading.Thread] = []
+        self.busy = 0
+
+
+class StagedExecutor:
+    """
+    Runs items through a fixed sequence of stages, each with its own bounded queue and thread pool
+    Different items occupy different stages at the same time, so e.g. segmentation of one request
+    overlaps rendering of the previous one; a full queue blocks the stage feeding it (backpressure)
+    """
+
+    def __init__(self, stages: List[Tuple[str, Callable[[Any], Any], int]], queue_size: int = 4):
+        if not stages:
+            raise ValueError("StagedExecutor needs at least one stage")
+        self.stages = [Stage(name, fn, workers, queue_size) for name, fn, workers in stages]
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+        for index, stage in enumerate(self.stages):
+            for i in range(stage.workers):
+                thread = threading.Thread(target=self._run_stage, args=(index,),
+                                          name=f"stage-{stage.name}-{i}", daemon=True)
+                thread.start()
+                stage.threads.append(thread)
+
+    @property
+    def capacity(self) -> int:
+        """Items that can be actively processed at once across all stages"""
+        return sum(stage.workers for stage in self.stages)
+
+    def submit(self, item: Any) -> Future:
+        """Queue an item at the first stage; blocks while that stage's queue is full"""
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot submit after shutdown")
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self.stages[0].queue.put((future, item))
+        return future
+
+    def stats(self) -> dict:
+        """Queued and in-progress item counts per stage"""
+        return {stage.name: {'queued': stage.queue.qsize(), 'busy': stage.busy, 'workers': stage.workers}
+                for stage in self.stages}
+
+    def _run_stage(self, index: int):
+        stage = self.stages[index]
+        next_stage: Optional[Stage] = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            entry = stage.queue.get()
+            if entry is _STOP:
+                return
+            future, item = entry
+
+            with self._lock:
+                stage.busy += 1
+            try:
+                result = stage.fn(item)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            finally:
+                with self._lock:
+                    stage.busy -= 1
+
+            if next_stage is None:
+                future.set_result(result)
+            else:
+                next_stage.queue.put((future, result))
+
+    def shutdown(self):
+        """Finish every submitted item, then stop the stage threads in order"""
+        with self._lock:
+            self._shutdown = True
+        for stage in self.stages:
+            # A stage has handed all its items on once its threads exit, so the next stage's
+            # sentinels always queue up behind them
+            for _ in stage.threads:
+                stage.queue.put(_STOP)
+            for thread in stage.threads:
+                thread.join()
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Tuple
+from metrics import count_cache, time_stage
+from scene_compositor import render_title_card
+from tracing import span
+from video_encoder import FFmpegPipeEncoder
+
+class TitleCardCache:
+    """
+    On-disk cache of pre-encoded title card segments
+    Keyed by text, canvas size, fps, duration and codec profile so a cached segment can be
+    spliced into any video encoded with the same settings by stream copy
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def make_key(self, text: str, canvas_size: Tuple[int, int], fps: float, seconds: float,
+                 is_intro: bool, codec_profile: Dict) -> str:
+        params = {
+            'text': text,
+            'canvas_size': list(canvas_size),
+            'fps': fps,
+            'seconds': seconds,
+            'is_intro': is_intro,
+            'codec_profile': codec_profile,
+        }
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get(self, text: str, canvas_size: Tuple[int, int], fps: float, seconds: float, is_intro: bool,
+            encoder_kwargs: Dict) -> str:
+        """Path of the encoded title segment, rendering and encoding it on first use"""
+        # Thread counts change per request but never the bitstream format
+        codec_profile = {
+            'codec': encoder_kwargs.get('codec'),
+            'preset': encoder_kwargs.get('preset'),
+            'crf': encoder_kwargs.get('crf'),
+            'extra_args': self._profile_args(encoder_kwargs.get('extra_args') or []),
+        }
+        key = self.make_key(text, canvas_size, fps, seconds, is_intro, codec_profile)
+        path = os.path.join(self.cache_dir, f"title_{key[:24]}.mp4")
+        if os.path.exists(path):
+            count_cache('title_card', True)
+            return path
+
+        with self._lock:
+            count_cache('title_card', os.path.exists(path))
+            if not os.path.exists(path):
+                print(f"🎬 Encoding title card segment: {text!r}")
+                frame = render_title_card(text, canvas_size, is_intro)
+                with time_stage('encoding'), span('encode_title_card', text=text), \
+                        FFmpegPipeEncoder(path, canvas_size, fps, **encoder_kwargs) as encoder:
+                    for _ in range(int(round(seconds * fps))):
+                        encoder.write_frame(frame)
+        return path
+
+    def _profile_args(self, extra_args):
+        """Encoder arguments without the per-request '-threads' setting"""
+        args = list(extra_args)
+        if '-threads' in args:
+            index = args.index('-threads')
+            del args[index:index + 2]
+        return args
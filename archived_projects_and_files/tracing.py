@@ -0,0 +1,120 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+
+# Trace being recorded for the current request, if tracing was requested
+_current_trace: contextvars.ContextVar = contextvars.ContextVar('animation_trace', default=None)
+
+
+def _now_us() -> float:
+    # Wall clock so spans recorded in render worker processes line up with the request's own
+    return time.time() * 1e6
+
+
+def _jsonable(value):
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    return str(value)
+
+
+class Trace:
+    """
+    Spans for one request, written as Chrome trace event JSON (chrome://tracing, ui.perfetto.dev)
+    Spans from this process share one track, so stages run on different threads still nest;
+    spans collected in worker processes keep their own pid and appear as separate tracks
+    """
+
+    def __init__(self, name: str, **args):
+        self.name = name
+        self.args = dict(args)
+        self.pid = os.getpid()
+        self.start_us = _now_us()
+        self.events: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, start_us: float, end_us: float, args: Optional[Dict] = None):
+        event = {
+            'name': name, 'ph': 'X', 'pid': self.pid, 'tid': 1,
+            'ts': round(start_us, 1), 'dur': round(end_us - start_us, 1),
+            'args': {key: _jsonable(value) for key, value in (args or {}).items()},
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def extend(self, events: List[Dict]):
+        """Add spans recorded by another Trace, e.g. one returned from a render worker"""
+        with self._lock:
+            self.events.extend(events)
+
+    def annotate(self, **args):
+        """Attach request-level args (element count, image size, backbone) to the root span"""
+        self.args.update(args)
+
+    def to_json(self) -> Dict:
+        root = {
+            'name': self.name, 'ph': 'X', 'pid': self.pid, 'tid': 1,
+            'ts': round(self.start_us, 1), 'dur': round(_now_us() - self.start_us, 1),
+            'args': {key: _jsonable(value) for key, value in self.args.items()},
+        }
+        with self._lock:
+            events = list(self.events)
+        pids = sorted({event['pid'] for event in events} | {self.pid})
+        metadata = [
+            {'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 1,
+             'args': {'name': 'animation request' if pid == self.pid else f'render worker {pid}'}}
+            for pid in pids
+        ]
+        return {'traceEvents': metadata + [root] + events, 'displayTimeUnit': 'ms'}
+
+    def write(self, path: str) -> str:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_json(), f)
+        os.replace(tmp_path, path)
+        return path
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def use_trace(trace: Optional[Trace]):
+    """Make trace current in this thread; threads do not inherit it, so stage threads call this per item"""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def _record_span(trace: Trace, name: str, args: Dict):
+    start_us = _now_us()
+    try:
+        yield args
+    finally:
+        trace.add_span(name, start_us, _now_us(), args)
+
+
+def span(name: str, **args):
+    """
+    Record a span in the current trace; a no-op without one
+    Yields the span's args dict, so values known only afterwards can still be added
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return nullcontext(args)
+    return _record_span(trace, name, args)
+
+
+def annotate(**args):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.annotate(**args)
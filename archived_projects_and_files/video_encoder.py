@@ -0,0 +1,195 @@
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+import numpy as np
+from typing import Iterable, List, Optional, Tuple
+
+
+def find_ffmpeg() -> str:
+    """ffmpeg executable: FFMPEG_BINARY, then the one bundled with imageio-ffmpeg (MoviePy's), then PATH"""
+    binary = os.environ.get('FFMPEG_BINARY')
+    if binary:
+        return binary
+
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return 'ffmpeg'
+
+
+class FFmpegPipeEncoder:
+    """
+    Streams raw RGB frames into an ffmpeg subprocess over stdin
+    Frames pass through a bounded queue drained by a writer thread, so compositing overlaps
+    with encoding; the video is written next to its destination and renamed into place on close
+    """
+
+    def __init__(self, output_path: str, size: Tuple[int, int], fps: float, codec: str = 'libx264',
+                 preset: str = 'medium', crf: Optional[int] = None, queue_size: int = 8,
+                 extra_args: Optional[List[str]] = None):
+        self.output_path = output_path
+        self.size = size
+        self.fps = fps
+        self.codec = codec
+        self.preset = preset
+        self.crf = crf
+        self.extra_args = list(extra_args or [])
+        self.frames_written = 0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._process = None
+        self._writer = None
+        self._writer_error = None
+        self._stderr = None
+        self._tmp_path = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def command(self, output_path: str) -> List[str]:
+        width, height = self.size
+        cmd = [
+            find_ffmpeg(), '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r', str(self.fps), '-i', '-',
+            '-an', '-c:v', self.codec, '-preset', self.preset, '-pix_fmt', 'yuv420p',
+        ]
+        if self.crf is not None:
+            cmd += ['-crf', str(self.crf)]
+        cmd += self.extra_args
+        # Index up front so browsers can start playback before the download finishes
+        cmd += ['-movflags', '+faststart', '-f', 'mp4', output_path]
+        return cmd
+
+    def start(self):
+        output_dir = os.path.dirname(os.path.abspath(self.output_path))
+        os.makedirs(output_dir, exist_ok=True)
+        # Same directory as the destination so the final rename is atomic
+        self._tmp_path = os.path.join(output_dir, f".{os.path.basename(self.output_path)}.{os.getpid()}.tmp")
+
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(
+            self.command(self._tmp_path), stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._stderr
+        )
+        self._writer = threading.Thread(target=self._drain, name='ffmpeg-writer', daemon=True)
+        self._writer.start()
+
+    def write_frame(self, frame: np.ndarray):
+        """Queue one (height, width, 3) uint8 frame; blocks while the queue is full"""
+        if self._writer_error is not None:
+            raise RuntimeError(f"ffmpeg stopped accepting frames: {self._writer_error}")
+
+        width, height = self.size
+        if frame.shape != (height, width, 3):
+            raise ValueError(f"Frame shape {frame.shape} does not match encoder size {(height, width, 3)}")
+
+        # Frames are often a reused render buffer, so copy before handing off
+        self._queue.put(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+        self.frames_written += 1
+
+    def write_frames(self, frames: Iterable[np.ndarray]):
+        for frame in frames:
+            self.write_frame(frame)
+
+    def close(self) -> str:
+        """Finish encoding and move the video into place; returns the output path"""
+        self._queue.put(None)
+        self._writer.join()
+        returncode = self._process.wait()
+
+        if returncode != 0 or self._writer_error is not None:
+            message = self._read_stderr()
+            self._cleanup()
+            raise RuntimeError(f"ffmpeg exited with code {returncode}: {message or self._writer_error}")
+
+        os.replace(self._tmp_path, self.output_path)
+        self._stderr.close()
+        return self.output_path
+
+    def abort(self):
+        """Stop ffmpeg and discard the partial output"""
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+        if self._writer is not None:
+            # The writer drains the queue once the pipe breaks, so the sentinel always fits
+            try:
+                self._queue.put(None, timeout=5)
+            except queue.Full:
+                pass
+            self._writer.join(timeout=5)
+        if self._process is not None:
+            self._process.wait()
+        self._cleanup()
+
+    def _drain(self):
+        """Writer thread: move queued frames into ffmpeg's stdin"""
+        stdin = self._process.stdin
+        try:
+            while True:
+                data = self._queue.get()
+                if data is None:
+                    break
+                stdin.write(data)
+        except (BrokenPipeError, OSError) as e:
+            self._writer_error = e
+            # Keep consuming so producers never block on a dead encoder
+            while self._queue.get() is not None:
+                pass
+        finally:
+            try:
+                stdin.close()
+            except OSError:
+                pass
+
+    def _read_stderr(self) -> str:
+        try:
+            self._stderr.seek(0)
+            return self._stderr.read().decode('utf-8', errors='replace').strip()[-2000:]
+        except Exception:
+            return ''
+
+    def _cleanup(self):
+        if self._stderr is not None:
+            self._stderr.close()
+        if self._tmp_path and os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+def concat_segments(segment_paths: List[str], output_path: str):
+    """
+    Join encoded segments with ffmpeg's concat demuxer without re-encoding
+    Segments must share codec parameters; the result is renamed into place atomically
+    """
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(output_dir, exist_ok=True)
+    tmp_path = os.path.join(output_dir, f".{os.path.basename(output_path)}.{os.getpid()}.tmp")
+
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', dir=output_dir, delete=False) as list_file:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped}'\n")
+
+    cmd = [
+        find_ffmpeg(), '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_file.name,
+        '-c', 'copy', '-movflags', '+faststart', '-f', 'mp4', tmp_path,
+    ]
+    try:
+        result = subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            message = result.stderr.decode('utf-8', errors='replace').strip()[-2000:]
+            raise RuntimeError(f"ffmpeg concat exited with code {result.returncode}: {message}")
+        os.replace(tmp_path, output_path)
+    finally:
+        os.remove(list_file.name)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)